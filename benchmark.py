@@ -0,0 +1,672 @@
+"""
+Offline timing harness for the renderers.
+
+Reddit avatar lookups are short-circuited (every avatar falls back to the grey
+placeholder) and sample text avoids emoji, so only layout, drawing and
+encoding are measured.
+
+Usage: python benchmark.py bands [messages] [comments]
+       python benchmark.py measure [strings]
+       python benchmark.py prefork [workers] [jobs]
+       python benchmark.py handoff [messages] [runs]
+       python benchmark.py seeds
+       python benchmark.py sizes [messages] [comments]
+       python benchmark.py textcache [messages] [comments]
+       python benchmark.py shapes [messages] [comments]
+"""
+
+import asyncio
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("REDDIT_CLIENT_ID", "benchmark")
+os.environ.setdefault("REDDIT_SECRET", "benchmark")
+os.environ.setdefault("WARM_EMOJI", "")
+
+import renderer
+from PIL import Image, ImageDraw, ImageFont, features
+from renderer import Classification, RedditComment, TextMessage
+
+LEFT_COLORS = {"bubble_hex": "#e9e9eb", "text_hex": "#000000"}
+RIGHT_COLORS = {"bubble_hex": "#0b84fe", "text_hex": "#ffffff"}
+WORDS = (
+    "so anyway i told her we should grab coffee sometime and she said maybe "
+    "which honestly could mean anything at this point lol"
+).split()
+
+
+class OfflineReddit:
+    """Every user resolves to "no avatar" without touching the network."""
+
+    def redditor(self, name):
+        return SimpleNamespace(icon_img=None, fullname=None)
+
+
+def sample_text(i):
+    length = 3 + (i * 7) % 40
+    return " ".join(WORDS[(i + k) % len(WORDS)] for k in range(length))
+
+
+def sample_conversation(count):
+    classifications = list(Classification)
+    return [
+        TextMessage(
+            side="left" if (i // 2) % 2 else "right",
+            content=sample_text(i),
+            classification=classifications[i % len(classifications)],
+        )
+        for i in range(count)
+    ]
+
+
+def sample_chain(count):
+    classifications = list(Classification)
+    return [
+        RedditComment(
+            username=f"user_{i % 10}",
+            content=sample_text(i),
+            classification=classifications[i % len(classifications)],
+        )
+        for i in range(count)
+    ]
+
+
+def conversation_payload(count):
+    """sample_conversation(count) as a render_and_upload payload."""
+    return {
+        "messages": [
+            {
+                "side": m.side,
+                "content": m.content,
+                "classification": m.classification.value,
+            }
+            for m in sample_conversation(count)
+        ],
+        "color": {
+            "left": LEFT_COLORS,
+            "right": RIGHT_COLORS,
+            "background_hex": "#ffffff",
+        },
+    }
+
+
+def chain_payload(count):
+    """sample_chain(count) as a render_and_upload_reddit_chain payload."""
+    return [
+        {
+            "username": m.username,
+            "content": m.content,
+            "classification": m.classification.value,
+        }
+        for m in sample_chain(count)
+    ]
+
+
+def best_of(fn, repeat=3):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def bench_bands(message_count=120, comment_count=50):
+    """Speedup of band-parallel rendering versus the serial path."""
+    renderer.avatar_resolver = renderer.AvatarResolver(OfflineReddit())
+    conversation = sample_conversation(message_count)
+    chain = sample_chain(comment_count)
+    out_path = os.path.join(tempfile.gettempdir(), "benchmark_bands.png")
+
+    cases = [
+        (
+            f"render_conversation ({message_count} messages)",
+            lambda workers: renderer.render_conversation(
+                conversation,
+                LEFT_COLORS,
+                RIGHT_COLORS,
+                "#ffffff",
+                out_path,
+                workers=workers,
+            ),
+        ),
+        (
+            f"render_reddit_chain ({comment_count} comments)",
+            lambda workers: renderer.render_reddit_chain(
+                chain, out_path, workers=workers
+            ),
+        ),
+    ]
+    for label, render in cases:
+        print(f"\n{label}")
+        baseline = None
+        for workers in (1, 2, 4, 8):
+            elapsed = best_of(lambda: render(workers))
+            baseline = baseline or elapsed
+            print(
+                f"  bands={workers}: {elapsed:.3f}s  speedup x{baseline / elapsed:.2f}"
+            )
+
+
+def textbbox_only(draw, text, font, anchor=None):
+    return draw.textbbox((0, 0), text, font=font, anchor=anchor)
+
+
+def bench_measure(string_count=2000):
+    """Checks the table route against FreeType and times both wrap paths."""
+    rng = random.Random(0)
+    alphabet = (
+        "abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789"
+        " .,!?'\"-()éüñçÀ—…“”"
+    )
+    strings = [
+        "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 60)))
+        for _ in range(string_count)
+    ]
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+    fonts = [
+        ImageFont.truetype("fonts/Inter.ttf", 56),
+        ImageFont.truetype("fonts/Inter.ttf", 64),
+        ImageFont.truetype("fonts/Inter Bold.ttf", 56),
+    ]
+    # Production wheels usually have raqm, which draws with Inter's GPOS
+    # kerning; text_bbox then skips the tables, and this shows by how much
+    # they would have been off.
+    raqm = features.check("raqm")
+    print(f"default layout engine: {fonts[0].layout_engine} (0=BASIC, 1=RAQM)")
+    if not raqm:
+        print(
+            "Warning: Pillow here has no raqm, so the tables are only checked "
+            "against BASIC; the widths raqm draws are not compared."
+        )
+    for font in fonts:
+        basic = ImageFont.truetype(
+            font.path, font.size, layout_engine=ImageFont.Layout.BASIC
+        )
+        shaped = raqm and ImageFont.truetype(
+            font.path, font.size, layout_engine=ImageFont.Layout.RAQM
+        )
+        metrics = renderer.GlyphMetrics(font)
+        for anchor in (None, "lt"):
+            basic_diffs = raqm_diffs = max_delta = 0
+            for text in strings:
+                table = metrics.bbox(text, anchor)
+                basic_diffs += table != draw.textbbox((0, 0), text, basic, anchor)
+                if shaped:
+                    drawn = draw.textbbox((0, 0), text, shaped, anchor)
+                    raqm_diffs += table != drawn
+                    max_delta = max(max_delta, abs(table[2] - drawn[2]))
+            against_raqm = (
+                f", {raqm_diffs}/{string_count} from raqm "
+                f"(max width delta {max_delta}px)"
+                if shaped
+                else ""
+            )
+            print(
+                f"  {os.path.basename(font.path)} {font.size}px anchor={anchor}: "
+                f"{basic_diffs}/{string_count} differ from BASIC{against_raqm}"
+            )
+
+    if raqm:
+        print("Fonts below default to raqm, so both wrap paths use textbbox.")
+    conversation = [m.content for m in sample_conversation(400)]
+    font = ImageFont.truetype("fonts/Inter.ttf", 56)
+    wrap = lambda: [renderer.wrap_text(t, draw, font, 864) for t in conversation]
+    chain_font = ImageFont.truetype("fonts/Inter.ttf", 64)
+    measure = lambda t, f: renderer.text_bbox(draw, t, f, "lt")[2:]
+    wrap_chain = lambda: [
+        renderer.wrap_text_by_width(t, chain_font, 1031, measure) for t in conversation
+    ]
+
+    fast_results = (wrap(), wrap_chain())
+    fast_times = (best_of(wrap), best_of(wrap_chain))
+    renderer.text_bbox, table_bbox = textbbox_only, renderer.text_bbox
+    try:
+        slow_results = (wrap(), wrap_chain())
+        slow_times = (best_of(wrap), best_of(wrap_chain))
+    finally:
+        renderer.text_bbox = table_bbox
+
+    for label, fast, slow, same in zip(
+        ("wrap_text", "wrap_text_by_width"),
+        fast_times,
+        slow_times,
+        (a == b for a, b in zip(fast_results, slow_results)),
+    ):
+        print(
+            f"{label} x{len(conversation)}: textbbox {slow:.3f}s, "
+            f"tables {fast:.3f}s (x{slow / fast:.1f}), identical lines: {same}"
+        )
+
+
+def render_job(job):
+    """prefork handler that renders without uploading."""
+    renderer.avatar_resolver = renderer.AvatarResolver(OfflineReddit())
+    out_path = os.path.join(tempfile.gettempdir(), f"{job['uid']}.png")
+    messages, color_block = renderer.parse_payload(job["command"], job["payload"])
+    if job["command"] == "render_and_upload":
+        renderer.render_conversation(
+            messages,
+            color_block["left"],
+            color_block["right"],
+            color_block["background_hex"],
+            out_path,
+        )
+    else:
+        renderer.render_reddit_chain(messages, out_path)
+    os.remove(out_path)
+
+
+def memory_kb(pid):
+    """Rss / Pss / Private from /proc/<pid>/smaps_rollup, in kB."""
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            key, _, rest = line.partition(":")
+            if rest.strip().endswith("kB"):
+                fields[key] = int(rest.split()[0])
+    return {
+        "rss": fields["Rss"],
+        "pss": fields["Pss"],
+        "private": fields["Private_Clean"] + fields["Private_Dirty"],
+    }
+
+
+def bench_prefork(worker_count=4, job_count=16):
+    """Per-worker memory of the warm forked pool against spawned workers."""
+    import prefork
+
+    conversation = conversation_payload(30)
+    chain = chain_payload(10)
+    jobs = [
+        {"command": "render_and_upload", "uid": f"bench{i}", "payload": conversation}
+        if i % 2
+        else {
+            "command": "render_and_upload_reddit_chain",
+            "uid": f"bench{i}",
+            "payload": chain,
+        }
+        for i in range(job_count)
+    ]
+
+    for start_method in ("fork", "spawn"):
+        started = time.perf_counter()
+        pool = prefork.WarmPool(
+            worker_count, handler=render_job, start_method=start_method
+        )
+        results = pool.map(jobs)
+        elapsed = time.perf_counter() - started
+        errors = [error for *_, error in results if error]
+        usage = [memory_kb(process.pid) for process in pool.processes]
+        pool.close()
+        print(
+            f"{start_method}: {len(jobs)} jobs on {worker_count} workers in "
+            f"{elapsed:.2f}s (incl. startup), {len(errors)} errors"
+        )
+        for key in ("rss", "pss", "private"):
+            values = [u[key] / 1024 for u in usage]
+            print(
+                f"  {key:>7}: mean {sum(values) / len(values):6.1f} MiB/worker, "
+                f"total {sum(values):7.1f} MiB"
+            )
+
+
+def encode_and_send(mode, image, spool_name, channel):
+    """Handoff benchmark worker: encodes `image` and hands it to the parent."""
+    import tracemalloc
+
+    tracemalloc.start()
+    if mode == "pickle":
+        buf = io.BytesIO()
+        image.save(buf, "PNG")
+        message = buf.getvalue()
+    else:
+        message = renderer.spool_path(spool_name)
+        image.save(message, "PNG")
+    peak = tracemalloc.get_traced_memory()[1]
+    # perf_counter is CLOCK_MONOTONIC, comparable across processes.
+    channel.send((time.perf_counter(), peak, message))
+
+
+def serve_stub(channel):
+    """Image host stub in its own process, so its reads aren't traced."""
+    import loadtest
+
+    channel.send(loadtest.start_stub(0, 0).url)
+    channel.recv()
+
+
+def bench_handoff(message_count=120, runs=5):
+    """Render-to-upload handoff across processes: pickled bytes vs the spool."""
+    import multiprocessing
+    import tracemalloc
+
+    from handoff import MultipartStream, SpooledFile
+
+    renderer.avatar_resolver = renderer.AvatarResolver(OfflineReddit())
+    rendered = os.path.join(tempfile.gettempdir(), "benchmark_handoff.png")
+    renderer.render_conversation(
+        sample_conversation(message_count),
+        LEFT_COLORS,
+        RIGHT_COLORS,
+        "#ffffff",
+        rendered,
+    )
+    image = Image.open(rendered)
+    image.load()
+    size = os.path.getsize(rendered)
+    print(f"{image.size[0]}x{image.size[1]} image, {size / 1024:.0f} KiB as PNG")
+
+    ctx = multiprocessing.get_context("fork")
+    stub_channel, child_channel = ctx.Pipe()
+    stub = ctx.Process(target=serve_stub, args=(child_channel,), daemon=True)
+    stub.start()
+    url = f"{stub_channel.recv()}/api/1/upload"
+    for mode in ("pickle", "spool"):
+        latencies, parent_peaks, worker_peaks = [], [], []
+        for run in range(runs):
+            receiver, sender = ctx.Pipe(duplex=False)
+            worker = ctx.Process(
+                target=encode_and_send,
+                args=(mode, image, f"benchmark_handoff{run}.png", sender),
+            )
+            worker.start()
+            tracemalloc.start()
+            encoded, worker_peak, message = receiver.recv()
+            if mode == "pickle":
+                files = {"source": ("image.png", message)}
+                renderer.http.post(url, files=files).raise_for_status()
+            else:
+                spooled = SpooledFile(message)
+                body = MultipartStream(
+                    files={"source": ("image.png", spooled.view, "image/png")}
+                )
+                renderer.http.post(
+                    url, data=body, headers={"Content-Type": body.content_type}
+                ).raise_for_status()
+                body.close()
+                spooled.unlink()
+            latencies.append(time.perf_counter() - encoded)
+            parent_peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+            del message
+            worker.join()
+            worker_peaks.append(worker_peak)
+        print(
+            f"{mode:>6}: encoded to uploaded in "
+            f"{sorted(latencies)[runs // 2] * 1000:6.1f}ms (median); peak Python "
+            f"heap {max(worker_peaks) / size:.2f}x the PNG in the worker, "
+            f"{max(parent_peaks) / size:.2f}x in the uploader"
+        )
+    stub_channel.send("stop")
+    stub.join()
+
+
+def bench_seeds():
+    """Times every input fuzz.py saved as a regression seed."""
+    from fuzz import FUZZ_SEEDS, placeholder_emoji
+
+    if not os.path.exists(FUZZ_SEEDS):
+        print(f"No seeds yet ({FUZZ_SEEDS}); run fuzz.py to collect some.")
+        return
+    renderer.avatar_resolver = renderer.AvatarResolver(OfflineReddit())
+    renderer.CachedAppleEmojiSource.request = placeholder_emoji
+    out_path = renderer.spool_path("benchmark_seed.png")
+    with open(FUZZ_SEEDS, encoding="utf-8") as f:
+        seeds = [json.loads(line) for line in f if line.strip()]
+    for i, seed in enumerate(seeds):
+        messages, color_block = renderer.parse_payload(seed["command"], seed["payload"])
+        elapsed = best_of(
+            lambda: asyncio.run(
+                renderer.render_job(seed["command"], messages, color_block, out_path)
+            )
+        )
+        print(f"#{i} {elapsed:.3f}s  {seed.get('reason', '')}")
+    os.remove(out_path)
+
+
+def bench_sizes(message_count=60, comment_count=20):
+    """
+    Full, half and thumbnail outputs: reduced from one render versus
+    rendered separately (conversation at scale 4, 2 and 1) or LANCZOS-resized
+    from the full image.
+    """
+    renderer.avatar_resolver = renderer.AvatarResolver(OfflineReddit())
+    conversation = sample_conversation(message_count)
+    chain = sample_chain(comment_count)
+    out_path = renderer.spool_path("benchmark_sizes.png")
+    sizes = tuple(renderer.OUTPUT_SIZES)
+
+    def resized(render):
+        render(("full",))
+        full = Image.open(out_path)
+        full.load()
+        for name, factor in renderer.OUTPUT_SIZES.items():
+            if factor > 1:
+                size = (full.width // factor, full.height // factor)
+                full.resize(size, Image.LANCZOS).save(
+                    renderer.output_variant(out_path, name)
+                )
+
+    def conversation_at(scale, sizes=("full",)):
+        return renderer.render_conversation(
+            conversation,
+            LEFT_COLORS,
+            RIGHT_COLORS,
+            "#ffffff",
+            out_path,
+            scale=scale,
+            sizes=sizes,
+        )
+
+    def render_chain(sizes):
+        return renderer.render_reddit_chain(chain, out_path, sizes=sizes)
+
+    cases = [
+        (
+            f"render_conversation ({message_count} messages)",
+            {
+                "full only": lambda: conversation_at(4),
+                "one render + reduce": lambda: conversation_at(4, sizes),
+                "one render + LANCZOS": lambda: resized(
+                    lambda sizes: conversation_at(4, sizes)
+                ),
+                "three renders": lambda: [conversation_at(s) for s in (4, 2, 1)],
+            },
+        ),
+        (
+            f"render_reddit_chain ({comment_count} comments)",
+            {
+                "full only": lambda: render_chain(("full",)),
+                "one render + reduce": lambda: render_chain(sizes),
+                "one render + LANCZOS": lambda: resized(render_chain),
+            },
+        ),
+    ]
+    for label, variants in cases:
+        print(f"\n{label}")
+        baseline = None
+        for name, run in variants.items():
+            elapsed = best_of(run)
+            baseline = baseline or elapsed
+            print(f"  {name:<22} {elapsed:.3f}s  (+{elapsed - baseline:.3f}s)")
+    for name in sizes:
+        path = renderer.output_variant(out_path, name)
+        if os.path.exists(path):
+            os.remove(path)
+
+
+REACTIONS = ["lol", "ok", "???", "fr", "no way", "😂", "💀", "😭😭", "wait what 😳"]
+
+
+def bench_textcache(message_count=120, comment_count=50):
+    """
+    Reaction-heavy payloads (four in five messages from REACTIONS) with the
+    text raster cache off, cold (cleared before every render) and warm.
+    """
+    from fuzz import placeholder_emoji
+
+    renderer.avatar_resolver = renderer.AvatarResolver(OfflineReddit())
+    renderer.CachedAppleEmojiSource.request = placeholder_emoji
+    out_path = renderer.spool_path("benchmark_textcache.png")
+    conversation = sample_conversation(message_count)
+    chain = sample_chain(comment_count)
+    for i, message in enumerate(conversation + chain):
+        if i % 5:
+            message.content = REACTIONS[i % len(REACTIONS)]
+
+    cases = [
+        (
+            f"render_conversation ({message_count} messages)",
+            lambda: renderer.render_conversation(
+                conversation, LEFT_COLORS, RIGHT_COLORS, "#ffffff", out_path
+            ),
+        ),
+        (
+            f"render_reddit_chain ({comment_count} comments)",
+            lambda: renderer.render_reddit_chain(chain, out_path),
+        ),
+    ]
+    max_chars = renderer.TEXT_CACHE_MAX_CHARS
+    for label, render in cases:
+        print(f"\n{label}")
+        render()  # emoji and badges loaded before timing
+        renderer.TEXT_CACHE_MAX_CHARS = -1
+        baseline = best_of(render, 5)
+        renderer.TEXT_CACHE_MAX_CHARS = max_chars
+        print(f"  cache off: {baseline:.3f}s")
+        renderer.text_cache = renderer.RasterCache(renderer.TEXT_CACHE_BYTES)
+        cold = best_of(lambda: (renderer.text_cache.clear(), render()), 5)
+        print(f"  cold:      {cold:.3f}s  x{baseline / cold:.2f}")
+        warm = best_of(render, 5)
+        print(f"  warm:      {warm:.3f}s  x{baseline / warm:.2f}")
+        renderer.text_cache.report()
+    os.remove(out_path)
+
+
+# How far the distance-field shapes may drift from the supersampled ones:
+# differences belong on antialiased edges, never across whole regions.
+MAX_MEAN_DIFF = 0.5  # levels, averaged over every channel of every pixel
+MAX_CHANGED_SHARE = 0.02  # of pixels differing by more than 8 levels
+
+
+def bench_shapes(message_count=120, comment_count=50):
+    """
+    Distance-field bubbles and avatars against the Pillow shapes (drawn
+    aliased, or at 4x and downsampled): pixel differences and timings.
+    Exits non-zero when the differences exceed the tolerance.
+    """
+    import numpy as np
+
+    renderer.avatar_resolver = renderer.AvatarResolver(OfflineReddit())
+    conversation = sample_conversation(message_count)
+    chain = sample_chain(comment_count)
+    out_path = renderer.spool_path("benchmark_shapes.png")
+
+    def use_sdf(enabled):
+        renderer.USE_SDF = enabled
+        renderer.avatar_mask.cache_clear()
+
+    cases = [
+        (
+            f"render_conversation ({message_count} messages)",
+            lambda: renderer.render_conversation(
+                conversation, LEFT_COLORS, RIGHT_COLORS, "#ffffff", out_path
+            ),
+        ),
+        (
+            f"render_reddit_chain ({comment_count} comments)",
+            lambda: renderer.render_reddit_chain(chain, out_path),
+        ),
+    ]
+    failed = False
+    for label, render in cases:
+        print(f"\n{label}")
+        outputs, timings = {}, {}
+        for enabled in (False, True):
+            use_sdf(enabled)
+            timings[enabled] = best_of(render)
+            outputs[enabled] = np.asarray(Image.open(out_path).convert("RGB"))
+        diff = np.abs(outputs[True].astype(int) - outputs[False])
+        mean = diff.mean()
+        changed = (diff.max(axis=2) > 8).mean()
+        ok = mean <= MAX_MEAN_DIFF and changed <= MAX_CHANGED_SHARE
+        failed |= not ok
+        print(
+            f"  Pillow shapes {timings[False]:.3f}s, distance field "
+            f"{timings[True]:.3f}s  x{timings[False] / timings[True]:.2f}"
+        )
+        print(
+            f"  {'ok' if ok else 'FAIL'}: mean diff {mean:.3f} levels, "
+            f"{100 * changed:.2f}% of pixels off by more than 8, "
+            f"max {diff.max()}"
+        )
+
+    print("\nShapes alone")
+    scale = 4
+    box, radius = (48, 0, 48 + 600, 160), 16 * scale
+    tail = [(50, 144), (24, 160), (88, 156)]
+
+    def pillow_bubble():
+        layer = Image.new("RGBA", (1280, 200), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(layer)
+        draw.polygon(tail, fill="#0b84fe")
+        draw.rounded_rectangle(box, radius, fill="#0b84fe")
+
+    def sdf_bubble():
+        layer = Image.new("RGBA", (1280, 200), (0, 0, 0, 0))
+        renderer.shapes.draw_bubble(layer, box, radius, "#0b84fe", tail)
+
+    def avatar(enabled):
+        use_sdf(enabled)
+        source = Image.new("RGBA", (256, 256), "#ff4500")
+        for _ in range(10):
+            renderer.avatar_mask.cache_clear()
+            renderer.avatar_mask(136)
+            if enabled:
+                avatar = source.resize((136, 136), Image.LANCZOS)
+            else:
+                avatar = source.resize((544, 544), Image.LANCZOS)
+                avatar = avatar.resize((136, 136), Image.LANCZOS)
+
+    for name, pillow, sdf in (
+        ("bubble + tail", pillow_bubble, sdf_bubble),
+        ("10 avatars + masks", lambda: avatar(False), lambda: avatar(True)),
+    ):
+        before, after = best_of(pillow, 10), best_of(sdf, 10)
+        print(
+            f"  {name:<20} Pillow {before * 1000:7.2f}ms, distance field "
+            f"{after * 1000:7.2f}ms  x{before / after:.2f}"
+        )
+    use_sdf(True)
+    os.remove(out_path)
+    if failed:
+        sys.exit(1)
+
+
+BENCHMARKS = {
+    "bands": bench_bands,
+    "measure": bench_measure,
+    "prefork": bench_prefork,
+    "handoff": bench_handoff,
+    "seeds": bench_seeds,
+    "sizes": bench_sizes,
+    "textcache": bench_textcache,
+    "shapes": bench_shapes,
+}
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python benchmark.py [{'|'.join(BENCHMARKS)}] [args...]")
+        sys.exit(1)
+
+    BENCHMARKS[sys.argv[1]](*(int(arg) for arg in sys.argv[2:]))
@@ -0,0 +1,322 @@
+"""
+Adversarial performance fuzzing for text wrapping and rendering.
+
+Generates inputs from families known to stress the wrappers and Pilmoji
+(long spaceless strings, thousands of newlines, runs of spaces, ZWJ emoji
+sequences, combining marks, right-to-left text, and random mixtures of all
+of them) and checks that:
+
+- doubling the input at most roughly doubles the work of wrap_text,
+  wrap_text_by_width and Pilmoji.getsize: measurement calls, characters
+  measured, and time;
+- both renderers finish within a wall-clock budget, after admission
+  control, on adversarial payloads.
+
+Emoji images come from a local placeholder and avatars are short-circuited,
+so nothing touches the network. Every failing input is appended to
+FUZZ_SEEDS (default fuzz_seeds.jsonl) as a replayable job in loadtest's
+corpus format; `python benchmark.py seeds` times them.
+
+Usage: python fuzz.py [seed] [cases]
+Exits non-zero when any check fails.
+"""
+
+import io
+import json
+import os
+import random
+import sys
+import time
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault("REDDIT_CLIENT_ID", "fuzz")
+os.environ.setdefault("REDDIT_SECRET", "fuzz")
+os.environ.setdefault("WARM_EMOJI", "")
+
+import renderer
+from benchmark import LEFT_COLORS, RIGHT_COLORS, OfflineReddit
+from PIL import Image, ImageDraw
+from pilmoji import Pilmoji
+from renderer import Classification, RedditComment, TextMessage
+
+FUZZ_SEEDS = os.environ.get("FUZZ_SEEDS", "fuzz_seeds.jsonl")
+# Allowed growth when the input doubles: work may not more than ~double.
+MAX_WORK_RATIO = 2.5
+# Time is noisier; only compared once the smaller case takes this long.
+MAX_TIME_RATIO = 3.0
+MIN_TIMED_SECONDS = 0.01
+RENDER_BUDGET_SECONDS = float(os.environ.get("FUZZ_RENDER_BUDGET", "30"))
+
+ZWJ_EMOJI = ["👨‍👩‍👧‍👦", "🏳️‍🌈", "👩🏽‍💻", "🧑‍🤝‍🧑", "❤️‍🔥"]
+COMBINING = ["́", "̈", "̧", "̣", "ͯ"]
+RTL_WORDS = ["שלום", "עולם", "مرحبا", "بالعالم", "كيف", "حالك"]
+LATIN = "abcdefghijklmnopqrstuvwxyz"
+
+
+def spaceless(rng, n):
+    return "".join(rng.choice(LATIN) for _ in range(n))
+
+
+def newlines(rng, n):
+    return "".join(rng.choice(["\n", "x\n", "\n\n", "ok\n"]) for _ in range(n // 2))
+
+
+def space_runs(rng, n):
+    return "".join(rng.choice([" " * rng.randint(1, 40), "w"]) for _ in range(n // 10))
+
+
+def zwj(rng, n):
+    return " ".join(rng.choice(ZWJ_EMOJI) * rng.randint(1, 3) for _ in range(n // 8))
+
+
+def combining(rng, n):
+    return "".join(
+        rng.choice(LATIN) + "".join(rng.choices(COMBINING, k=rng.randint(0, 4)))
+        for _ in range(n // 3)
+    )
+
+
+def rtl(rng, n):
+    return " ".join(rng.choice(RTL_WORDS) for _ in range(n // 5))
+
+
+def mixed(rng, n):
+    families = [spaceless, newlines, space_runs, zwj, combining, rtl]
+    return "".join(rng.choice(families)(rng, n // 6) for _ in range(6))
+
+
+FAMILIES = {
+    "spaceless": spaceless,
+    "newlines": newlines,
+    "space_runs": space_runs,
+    "zwj": zwj,
+    "combining": combining,
+    "rtl": rtl,
+    "mixed": mixed,
+}
+
+
+def placeholder_emoji(source, url):
+    """Stands in for the emoji CDN: every emoji is the same local image."""
+    buf = io.BytesIO()
+    Image.new("RGBA", (160, 160), "#ffcc00").save(buf, "PNG")
+    return buf.getvalue()
+
+
+def grow(text, factor):
+    """`text` repeated so it is `factor` times as long, same character mix."""
+    return text * factor
+
+
+class Counter:
+    """
+    Wraps a measuring function, counting calls and characters measured; the
+    text is positional argument `text_index`.
+    """
+
+    def __init__(self, fn, text_index=0):
+        self.fn = fn
+        self.text_index = text_index
+        self.calls = self.chars = 0
+
+    def __call__(self, *args, **kwargs):
+        self.calls += 1
+        self.chars += len(args[self.text_index])
+        return self.fn(*args, **kwargs)
+
+
+def run_wrap_text(text):
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    font = renderer.load_font("fonts/Inter.ttf", 56)
+    counter = renderer.text_bbox = Counter(renderer.text_bbox, text_index=1)
+    try:
+        started = time.perf_counter()
+        renderer.wrap_text(text, draw, font, 864)
+        return counter, time.perf_counter() - started
+    finally:
+        renderer.text_bbox = counter.fn
+
+
+def run_wrap_text_by_width(text):
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    font = renderer.load_font("fonts/Inter.ttf", 64)
+    counter = Counter(lambda t, f: renderer.text_bbox(draw, t, f, "lt")[2:])
+    started = time.perf_counter()
+    renderer.wrap_text_by_width(text, font, 1031, counter)
+    return counter, time.perf_counter() - started
+
+
+def run_pilmoji_getsize(text):
+    font = renderer.load_font("fonts/Inter.ttf", 56)
+    canvas = Image.new("RGB", (1, 1))
+    with Pilmoji(canvas, source=renderer.CachedAppleEmojiSource) as pilmoji:
+        counter = Counter(pilmoji.getsize)
+        started = time.perf_counter()
+        # One call per line, the way the renderers measure wrapped text.
+        for line in text.split("\n"):
+            counter(line, font, emoji_scale_factor=1.3)
+    return counter, time.perf_counter() - started
+
+
+TARGETS = {
+    "wrap_text": run_wrap_text,
+    "wrap_text_by_width": run_wrap_text_by_width,
+    "Pilmoji.getsize": run_pilmoji_getsize,
+}
+
+
+def save_seed(command, payload, reason):
+    with open(FUZZ_SEEDS, "a", encoding="utf-8") as f:
+        f.write(
+            json.dumps(
+                {"command": command, "payload": payload, "reason": reason},
+                ensure_ascii=False,
+            )
+            + "\n"
+        )
+
+
+def text_payload(text):
+    return {
+        "messages": [{"side": "left", "content": text, "classification": "good"}],
+        "color": {
+            "left": LEFT_COLORS,
+            "right": RIGHT_COLORS,
+            "background_hex": "#ffffff",
+        },
+    }
+
+
+def check_scaling(name, target, family, text):
+    """
+    Runs `target` on `text`, 2x and 4x of it. Returns failure messages and
+    the largest growth in calls or characters measured per doubling.
+    """
+    runs = []
+    for factor in (1, 2, 4):
+        counter, elapsed = target(grow(text, factor))
+        # Best of two for the timing; the counts are deterministic.
+        elapsed = min(elapsed, target(grow(text, factor))[1])
+        runs.append((counter.calls, counter.chars, elapsed))
+
+    failures, worst = [], 0.0
+    for (calls, chars, seconds), (calls2, chars2, seconds2) in zip(runs, runs[1:]):
+        worst = max(worst, calls2 / max(calls, 1), chars2 / max(chars, 1))
+        for label, small, big, limit in (
+            ("calls", calls, calls2, MAX_WORK_RATIO),
+            ("chars measured", chars, chars2, MAX_WORK_RATIO),
+            ("time", seconds, seconds2, MAX_TIME_RATIO),
+        ):
+            if label == "time" and small < MIN_TIMED_SECONDS:
+                continue
+            if small and big / small > limit:
+                failures.append(
+                    f"{name} on {family} ({len(text)} chars): {label} grew "
+                    f"x{big / small:.2f} when the input doubled"
+                )
+    return failures, worst
+
+
+def check_render_budget(family, text, rng):
+    """Both renderers, through admission, on a payload of `text` messages."""
+    failures = []
+    classifications = list(Classification)
+    pieces = [text[i : i + 400] for i in range(0, len(text), 400)] or [text]
+    jobs = {
+        "render_and_upload": [
+            TextMessage(
+                rng.choice(["left", "right"]), piece, rng.choice(classifications)
+            )
+            for piece in pieces
+        ],
+        "render_and_upload_reddit_chain": [
+            RedditComment(f"user_{i % 5}", piece, rng.choice(classifications))
+            for i, piece in enumerate(pieces)
+        ],
+    }
+    out_path = renderer.spool_path("fuzz.png")
+    for command, messages in jobs.items():
+        renderer.prefetch_emoji(m.content for m in messages)
+        admission = renderer.admit(messages, renderer.RenderLimits())
+        if admission.action == "reject":
+            continue
+        started = time.perf_counter()
+        deadline = time.monotonic() + RENDER_BUDGET_SECONDS
+        try:
+            if command == "render_and_upload":
+                renderer.render_conversation(
+                    admission.messages,
+                    LEFT_COLORS,
+                    RIGHT_COLORS,
+                    "#ffffff",
+                    out_path,
+                    scale=2 if admission.action == "downgrade" else 4,
+                    deadline=deadline,
+                )
+            else:
+                renderer.render_reddit_chain(
+                    admission.messages, out_path, deadline=deadline
+                )
+        except TimeoutError:
+            pass
+        elapsed = time.perf_counter() - started
+        if elapsed > RENDER_BUDGET_SECONDS:
+            failures.append(
+                (
+                    command,
+                    f"{command} on {family} ({len(text)} chars, "
+                    f"{admission.action}): {elapsed:.1f}s over the "
+                    f"{RENDER_BUDGET_SECONDS:g}s budget",
+                )
+            )
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    return failures
+
+
+def main():
+    seed = int(sys.argv[1]) if len(sys.argv) > 1 else int(time.time())
+    cases = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    rng = random.Random(seed)
+    print(f"Fuzzing with seed {seed}, {cases} case(s) per family")
+
+    renderer.avatar_resolver = renderer.AvatarResolver(OfflineReddit())
+    renderer.CachedAppleEmojiSource.request = placeholder_emoji
+
+    failed = 0
+    for family, generate in FAMILIES.items():
+        for _ in range(cases):
+            text = generate(rng, 600)
+            growth = []
+            for name, target in TARGETS.items():
+                failures, worst = check_scaling(name, target, family, text)
+                growth.append(f"{name} x{worst:.2f}")
+                for failure in failures:
+                    print(f"FAIL {failure}")
+                    save_seed("render_and_upload", text_payload(text), failure)
+                    failed += 1
+            big_text = generate(rng, 20000)
+            for command, failure in check_render_budget(family, big_text, rng):
+                print(f"FAIL {failure}")
+                if command == "render_and_upload":
+                    payload = text_payload(big_text)
+                else:
+                    payload = [
+                        {
+                            "username": "fuzz",
+                            "content": big_text,
+                            "classification": "good",
+                        }
+                    ]
+                save_seed(command, payload, failure)
+                failed += 1
+            print(f"ok   {family}: work per doubling {', '.join(growth)}")
+
+    if failed:
+        print(f"{failed} failure(s); inputs appended to {FUZZ_SEEDS}")
+        sys.exit(1)
+    print("All checks passed.")
+
+
+if __name__ == "__main__":
+    main()
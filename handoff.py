@@ -0,0 +1,136 @@
+"""
+Zero-copy handoff of encoded images between render and upload.
+
+Render workers encode straight into a spool file on a memory-backed
+filesystem (/dev/shm when available), and only the file's path crosses the
+process boundary. The upload side memory-maps the file and streams the
+multipart body out of the map, so the PNG is never copied into a Python
+bytes object: not for pickling, not for reading it back, and not for
+building the request body.
+
+SPOOL_DIR overrides where spool files go.
+"""
+
+import io
+import mmap
+import os
+import tempfile
+import uuid
+
+SPOOL_DIR = os.environ.get(
+    "SPOOL_DIR", "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+)
+
+
+def spool_path(name):
+    """Path for a spool file called `name` (e.g. "<uid>.png")."""
+    return os.path.join(SPOOL_DIR, name)
+
+
+class SpooledFile:
+    """
+    Read-only memory map of a spool file. `view` is a memoryview over the
+    whole file; close() (or leaving the with block) releases it, and
+    unlink() also deletes the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+
+    def __len__(self):
+        return len(self.view)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.view.release()
+        self.map.close()
+
+    def unlink(self):
+        self.close()
+        os.remove(self.path)
+
+
+class MultipartStream(io.RawIOBase):
+    """
+    multipart/form-data body read lazily from its parts. Fields are small and
+    encoded up front; a file part is any buffer (e.g. a SpooledFile's view)
+    and is read straight from it in slices. Has a length, so requests sends
+    Content-Length rather than chunked encoding, and seeks back to the start
+    so a retried request resends the whole body.
+    """
+
+    def __init__(self, fields=None, files=None):
+        self.boundary = uuid.uuid4().hex
+        self.parts = []
+        for name, value in (fields or {}).items():
+            self.parts.append(
+                (
+                    f"--{self.boundary}\r\n"
+                    f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+                    f"{value}\r\n"
+                ).encode()
+            )
+        for name, (filename, buffer, content_type) in (files or {}).items():
+            self.parts.append(
+                (
+                    f"--{self.boundary}\r\n"
+                    f'Content-Disposition: form-data; name="{name}"; '
+                    f'filename="{filename}"\r\n'
+                    f"Content-Type: {content_type}\r\n\r\n"
+                ).encode()
+            )
+            self.parts.append(memoryview(buffer).cast("B"))
+            self.parts.append(b"\r\n")
+        self.parts.append(f"--{self.boundary}--\r\n".encode())
+        self.length = sum(len(part) for part in self.parts)
+        self.seek(0)
+
+    @property
+    def content_type(self):
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self):
+        return self.length
+
+    def close(self):
+        # Let go of the file buffers so their memory maps can be closed.
+        for part in self.parts:
+            if isinstance(part, memoryview):
+                part.release()
+        super().close()
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (offset, whence) not in ((0, io.SEEK_SET), (0, io.SEEK_END)):
+            raise io.UnsupportedOperation("can only seek to the start or end")
+        self.position = 0 if whence == io.SEEK_SET else self.length
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def readinto(self, buffer):
+        # Find the part holding `position`, then copy what fits from there on.
+        written, start = 0, 0
+        for part in self.parts:
+            end = start + len(part)
+            if written < len(buffer) and self.position < end:
+                chunk = part[self.position - start :][: len(buffer) - written]
+                buffer[written : written + len(chunk)] = chunk
+                written += len(chunk)
+                self.position += len(chunk)
+            start = end
+        return written
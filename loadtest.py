@@ -0,0 +1,322 @@
+"""
+Load test for the render entry points.
+
+Replays a corpus of recorded payloads through renderer.run_job at a given
+concurrency and arrival rate, with Reddit, the avatar/emoji CDN and the image
+host replaced by local stub servers whose latency and error rate can be set.
+Reports throughput, p50/p95/p99 latency per stage (queueing, render, upload,
+total, and each stub host as seen by the HTTP transport), error rates and the
+process's peak RSS.
+
+The corpus is a JSON-lines file, one recorded job per line:
+    {"command": "render_and_upload", "payload": <RENDER_PAYLOAD_JSON>}
+Without --corpus, synthetic conversations and chains from benchmark.py are
+used.
+
+Usage: python loadtest.py [--corpus jobs.jsonl] [--jobs 50] [--concurrency 4]
+                          [--rate 2] [--upload-latency 0.3] [--upload-errors 0.05]
+                          ...  (see --help)
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from PIL import Image
+
+
+def _png(color, size):
+    buf = io.BytesIO()
+    Image.new("RGBA", size, color).save(buf, "PNG")
+    return buf.getvalue()
+
+
+AVATAR_PNG = _png("#ff4500", (256, 256))
+EMOJI_PNG = _png("#ffcc00", (160, 160))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Answers like Reddit (OAuth token, /user/<name>/about, bulk
+    user_data_by_account_ids), the avatar/emoji CDN and the image host.
+    Each server injects its own latency and error rate.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, body, content_type="application/json"):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def injected_failure(self):
+        server = self.server
+        time.sleep(server.latency * random.uniform(0.5, 1.5))
+        with server.lock:
+            server.requests += 1
+            if random.random() < server.error_rate:
+                server.errors += 1
+                self.reply(503, {"error": "injected"})
+                return True
+        return False
+
+    def do_HEAD(self):
+        if not self.injected_failure():
+            self.reply(200, b"")
+
+    def do_GET(self):
+        if self.injected_failure():
+            return
+        url = urlsplit(self.path)
+        parts = url.path.strip("/").split("/")
+        if parts[0] == "user" and len(parts) >= 3:
+            name = unquote(parts[1])
+            self.reply(
+                200,
+                {
+                    "kind": "t2",
+                    "data": {
+                        "name": name,
+                        "id": name.lower(),
+                        "icon_img": f"{self.server.cdn_url}/avatars/{name}.png",
+                    },
+                },
+            )
+        elif url.path.endswith("/api/user_data_by_account_ids"):
+            ids = parse_qs(url.query).get("ids", [""])[0].split(",")
+            self.reply(
+                200,
+                {
+                    fullname: {
+                        "name": fullname[3:],
+                        "profile_img": (
+                            f"{self.server.cdn_url}/avatars/{fullname[3:]}.png"
+                        ),
+                    }
+                    for fullname in ids
+                    if fullname
+                },
+            )
+        elif parts[0] == "avatars":
+            self.reply(200, AVATAR_PNG, "image/png")
+        else:
+            self.reply(200, EMOJI_PNG, "image/png")
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.injected_failure():
+            return
+        if self.path.startswith("/api/v1/access_token"):
+            self.reply(
+                200,
+                {
+                    "access_token": "loadtest",
+                    "token_type": "bearer",
+                    "expires_in": 86400,
+                    "scope": "*",
+                },
+            )
+        else:
+            self.reply(
+                200,
+                {
+                    "status_code": 200,
+                    "image": {
+                        "url": f"{self.server.url}/i/{time.time_ns()}.png",
+                        "delete_url": f"{self.server.url}/d",
+                    },
+                },
+            )
+
+
+def start_stub(latency, error_rate, cdn_url=None):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.error_rate = error_rate
+    server.url = f"http://127.0.0.1:{server.server_port}"
+    server.cdn_url = cdn_url or server.url
+    server.lock = threading.Lock()
+    server.requests = server.errors = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentiles(values):
+    values = sorted(values)
+    if not values:
+        return "-"
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return f"p50 {pick(0.5):7.3f}s  p95 {pick(0.95):7.3f}s  p99 {pick(0.99):7.3f}s"
+
+
+def load_corpus(path, jobs):
+    if path:
+        with open(path, encoding="utf-8") as f:
+            corpus = [json.loads(line) for line in f if line.strip()]
+    else:
+        import benchmark
+
+        corpus = [
+            {
+                "command": "render_and_upload",
+                "payload": benchmark.conversation_payload(n),
+            }
+            for n in (4, 12, 30)
+        ] + [
+            {
+                "command": "render_and_upload_reddit_chain",
+                "payload": benchmark.chain_payload(n),
+            }
+            for n in (3, 8, 20)
+        ]
+    return [corpus[i % len(corpus)] for i in range(jobs)]
+
+
+async def run_load(renderer, jobs, concurrency, rate, workers, verbose):
+    slots = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def one(i, job):
+        arrived = time.perf_counter()
+        async with slots:
+            timings = {"queue": time.perf_counter() - arrived}
+            output_path = os.path.join(tempfile.gettempdir(), f"loadtest{i}.png")
+            error = None
+            try:
+                messages, color_block = renderer.parse_payload(
+                    job["command"], job["payload"]
+                )
+                result = await renderer.run_job(
+                    job["command"],
+                    f"loadtest{i}",
+                    messages,
+                    color_block,
+                    "loadtest",
+                    output_path,
+                    workers=workers,
+                    timings=timings,
+                )
+                if not result or not result.get("image_url"):
+                    error = "upload failed"
+            except Exception as e:
+                error = repr(e)
+            finally:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+        results.append((job["command"], timings, error))
+
+    quiet = contextlib.redirect_stdout(io.StringIO())
+    with contextlib.nullcontext() if verbose else quiet:
+        tasks = []
+        for i, job in enumerate(jobs):
+            tasks.append(asyncio.create_task(one(i, job)))
+            if rate:
+                # Open loop: Poisson arrivals however far behind the jobs are.
+                await asyncio.sleep(random.expovariate(rate))
+        await asyncio.gather(*tasks)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", help="JSON-lines file of recorded jobs")
+    parser.add_argument("--jobs", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument(
+        "--rate", type=float, default=0, help="arrivals per second (0: closed loop)"
+    )
+    parser.add_argument("--workers", type=int, default=1, help="bands per render")
+    for stub, latency in (("reddit", 0.05), ("cdn", 0.05), ("upload", 0.3)):
+        parser.add_argument(f"--{stub}-latency", type=float, default=latency)
+        parser.add_argument(f"--{stub}-errors", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="show job output")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    cdn = start_stub(args.cdn_latency, args.cdn_errors)
+    reddit = start_stub(args.reddit_latency, args.reddit_errors, cdn_url=cdn.url)
+    upload = start_stub(args.upload_latency, args.upload_errors)
+    # The renderer reads its endpoints at import time.
+    os.environ.update(
+        REDDIT_URL=reddit.url,
+        REDDIT_OAUTH_URL=reddit.url,
+        EMOJI_CDN_URL=f"{cdn.url}/",
+        UPLOAD_API_URL=f"{upload.url}/api/1/upload",
+        WARM_EMOJI="",
+    )
+    os.environ.setdefault("REDDIT_CLIENT_ID", "loadtest")
+    os.environ.setdefault("REDDIT_SECRET", "loadtest")
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    import renderer
+
+    jobs = load_corpus(args.corpus, args.jobs)
+    print(
+        f"{len(jobs)} jobs, concurrency {args.concurrency}, "
+        f"{f'{args.rate:g}/s arrivals' if args.rate else 'closed loop'}"
+    )
+    started = time.perf_counter()
+    results = asyncio.run(
+        run_load(
+            renderer, jobs, args.concurrency, args.rate, args.workers, args.verbose
+        )
+    )
+    elapsed = time.perf_counter() - started
+
+    failed = [error for *_, error in results if error]
+    print(
+        f"\n{len(results)} jobs in {elapsed:.2f}s: "
+        f"{len(results) / elapsed:.2f} jobs/s, {len(failed)} failed "
+        f"({100 * len(failed) / len(results):.1f}%)"
+    )
+    for error in sorted(set(failed)):
+        print(f"  {failed.count(error)}x {error}")
+
+    for command in sorted({command for command, *_ in results}):
+        print(f"\n{command}")
+        for stage in ("queue", "render", "upload", "total"):
+            values = [t[stage] for c, t, _ in results if c == command and stage in t]
+            print(f"  {stage:<8} {percentiles(values)}")
+
+    print("\nHTTP (client side, per attempt)")
+    names = {reddit.url: "reddit", cdn.url: "cdn", upload.url: "upload"}
+    for host, stats in sorted(renderer.http.metrics.summary().items()):
+        print(
+            f"  {names.get(host, host):<8} p50 {stats['p50']:7.3f}s  "
+            f"p95 {stats['p95']:7.3f}s  p99 {stats['p99']:7.3f}s  "
+            f"{stats['requests']} requests, {stats['errors']} failed, "
+            f"{stats['retries']} retries"
+        )
+    for name, stub in (("reddit", reddit), ("cdn", cdn), ("upload", upload)):
+        print(
+            f"  {name:<8} stub served {stub.requests}, injected {stub.errors} errors"
+        )
+
+    print()
+    renderer.text_cache.report()
+
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"\nPeak RSS: {peak_kb / 1024:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
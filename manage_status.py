@@ -2,37 +2,125 @@ import os
 import sys
 import json
 import requests
+from transport import http
 
 # --- Configuration ---
 COOKIE_STRING = os.getenv("REDDIT_COOKIE")
 CSRF_TOKEN = os.getenv("REDDIT_CSRF_TOKEN")
 SUBREDDIT_ID = "t5_4kth6i"
 USER_AGENT = "GitHub-Actions-Status-Bot/1.0"
-GRAPHQL_URL = "https://www.reddit.com/svc/shreddit/graphql"
+GRAPHQL_URL = os.getenv("GRAPHQL_URL", "https://www.reddit.com/svc/shreddit/graphql")
+# Read operation used to look up the current status before changing it. Unset
+# by default, since Reddit doesn't document one; without it every run updates.
+STATUS_QUERY_OPERATION = os.getenv("STATUS_QUERY_OPERATION")
 
 
-# --- Helper Function ---
-def update_community_status(payload, action_description):
-    """Sends the API request to update the community status."""
-    if not COOKIE_STRING or not CSRF_TOKEN:
-        raise ValueError("Missing Reddit credentials in environment variables.")
-
-    headers = {
+# --- Helper Functions ---
+def request_headers():
+    return {
         "cookie": COOKIE_STRING,
         "user-agent": USER_AGENT,
         "origin": "https://www.reddit.com",
         "referer": f"https://www.reddit.com/r/TextingTheory/",
         "content-type": "application/json",
     }
+
+
+def find_status(node):
+    """
+    First object in a GraphQL response that looks like a community status,
+    {} for a status field that is explicitly null, or None when there's
+    neither.
+    """
+    if isinstance(node, dict):
+        if "emojiId" in node:
+            return node
+        if any(
+            value is None and key.lower().endswith("status")
+            for key, value in node.items()
+        ):
+            return {}
+        node = list(node.values())
+    if isinstance(node, list):
+        for child in node:
+            status = find_status(child)
+            if status is not None:
+                return status
+    return None
+
+
+def get_community_status():
+    """
+    The subreddit's current status as {"emojiId": ..., ...}, an empty dict
+    when the response says none is set, or None when it can't be determined
+    (including a response without a recognizable status, or no
+    STATUS_QUERY_OPERATION configured).
+    """
+    if not STATUS_QUERY_OPERATION:
+        return None
+    payload = {
+        "operation": STATUS_QUERY_OPERATION,
+        "variables": {"subredditId": SUBREDDIT_ID},
+        "csrf_token": CSRF_TOKEN,
+    }
+    try:
+        response = http.post(GRAPHQL_URL, headers=request_headers(), json=payload)
+        response.raise_for_status()
+        body = response.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Could not read the current status ({e}), updating.")
+        return None
+    if not isinstance(body, dict):
+        print("Could not read the current status (unexpected response), updating.")
+        return None
+    if body.get("errors"):
+        print(f"Could not read the current status ({body['errors']}), updating.")
+        return None
+    status = find_status(body.get("data"))
+    if status is None:
+        print("Could not find the current status in the response, updating.")
+    return status
+
+
+def status_matches(current, wanted):
+    """Whether `current` (from get_community_status) already is the `wanted` input."""
+    if current is None:
+        return False
+    if (current.get("emojiId") or "") != wanted.get("emojiId", ""):
+        return False
+    if not wanted.get("emojiId"):
+        return True  # Both cleared; a leftover description doesn't show.
+    wanted_text = wanted.get("description", {}).get("richText")
+    current_text = (current.get("description") or {}).get("richText")
+    if wanted_text is None or current_text is None:
+        return current_text == wanted_text
+    return json.loads(current_text) == json.loads(wanted_text)
+
+
+def update_community_status(payload, action_description):
+    """
+    Sends the API request to update the community status, unless the
+    community already has exactly that status.
+    """
+    if not COOKIE_STRING or not CSRF_TOKEN:
+        raise ValueError("Missing Reddit credentials in environment variables.")
+
+    if status_matches(get_community_status(), payload["variables"]["input"]):
+        print(f"\n✅ SKIPPED! Status already matches ({action_description}).")
+        http.metrics.report()
+        return
+
     print(f"Sending request to {action_description}...")
     try:
-        response = requests.post(GRAPHQL_URL, headers=headers, json=payload)
+        response = http.post(GRAPHQL_URL, headers=request_headers(), json=payload)
         response.raise_for_status()
         print(f"Status Code: {response.status_code}\nResponse: {response.text}")
         print(f"\n✅ SUCCESS! {action_description} completed.")
     except requests.RequestException as e:
         print(f"\n❌ FAILED! An error occurred: {e}")
         sys.exit(1)
+    finally:
+        http.metrics.report()
 
 
 # --- Action-specific Functions ---
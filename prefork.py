@@ -0,0 +1,275 @@
+"""
+Pre-forked pool of warm render workers.
+
+The parent imports renderer and warms every shared asset once (fonts, glyph
+metric tables, badge variants, avatar mask, emoji images), freezes the GC so
+those objects stay out of collection passes, then forks workers that share
+the pages copy-on-write. A worker exits after `max_jobs` jobs and is replaced
+by a fresh fork of the parent, which keeps per-worker heap fragmentation
+bounded. A worker that dies mid-job (OOM kill, segfault) is replaced too,
+and its job is reported as failed rather than retried, since it may well
+kill the next worker the same way.
+
+Jobs are JSON lines on stdin: {"command": ..., "uid": ..., "payload": ...}
+Each result is printed as a JSON line on stdout as soon as it's ready.
+
+With "split", workers only render, into the shared-memory spool (see
+handoff.py), and the parent uploads from the spool on a thread pool, so CPU
+workers never sit on network I/O and only file paths cross processes.
+
+Usage: python prefork.py [workers] [max_jobs] [split]
+"""
+
+import asyncio
+import collections
+import gc
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import renderer
+
+
+def handle_job(job):
+    """Renders and uploads one job; returns upload_with_api's result."""
+    command, uid = job["command"], job["uid"]
+    parsed_messages, color_block = renderer.parse_payload(command, job["payload"])
+    output_path = renderer.spool_path(f"{uid}.png")
+    try:
+        return asyncio.run(
+            renderer.run_job(
+                command,
+                uid,
+                parsed_messages,
+                color_block,
+                os.environ["ALLTHEPICS_API_KEY"],
+                output_path,
+                workers=int(os.environ.get("RENDER_WORKERS", "1")),
+            )
+        )
+    finally:
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+
+def render_to_spool(job):
+    """Renders one job into the spool; returns the file's path for upload_spooled."""
+    command, uid = job["command"], job["uid"]
+    parsed_messages, color_block = renderer.parse_payload(command, job["payload"])
+    output_path = renderer.spool_path(f"{uid}.png")
+    asyncio.run(
+        renderer.render_job(
+            command,
+            parsed_messages,
+            color_block,
+            output_path,
+            workers=int(os.environ.get("RENDER_WORKERS", "1")),
+        )
+    )
+    return output_path
+
+
+def upload_spooled(uid, path):
+    """Uploads and then deletes a render_to_spool result."""
+    try:
+        return renderer.upload_with_api(
+            os.environ["ALLTHEPICS_API_KEY"], path, title=uid, expiration="PT5M"
+        )
+    finally:
+        os.remove(path)
+
+
+def worker_loop(jobs, results, started, max_jobs, handler, warm):
+    if warm:
+        renderer.load_snapshot()
+        renderer.warm_assets()
+    for _ in range(max_jobs):
+        job = jobs.get()
+        if job is None:
+            return
+        # Lets the parent tell which job was lost if this worker dies. Unlike
+        # results.put, this is written before put() returns, not by a feeder
+        # thread that dies with the process.
+        started.put((job["uid"], os.getpid()))
+        try:
+            results.put((job["uid"], os.getpid(), handler(job), None))
+        except Exception as e:
+            results.put((job["uid"], os.getpid(), None, repr(e)))
+
+
+class WarmPool:
+    """
+    Runs jobs on `workers` processes, each recycled after `max_jobs` jobs.
+
+    With the default "fork" start method the parent warms the assets before
+    forking, so workers start warm and share them. "spawn" gives every worker
+    its own interpreter that warms itself, which is the non-forked baseline
+    (the handler must then be importable by name).
+    """
+
+    def __init__(
+        self, workers=4, max_jobs=100, handler=handle_job, start_method="fork"
+    ):
+        self.ctx = multiprocessing.get_context(start_method)
+        self.max_jobs = max_jobs
+        self.handler = handler
+        self.forked = start_method == "fork"
+        self.jobs = self.ctx.Queue()
+        self.results = self.ctx.Queue()
+        self.started = self.ctx.SimpleQueue()
+        self.closing = False
+        self.recycled = 0
+        # pid -> uid of the job each worker is on, from `started`.
+        self.running = {}
+        # Jobs of workers that exited mid-job: pid -> (uid, exitcode) until
+        # the queue has been drained once more, then failed results.
+        self.orphaned = {}
+        self.lost = collections.deque()
+
+        if self.forked:
+            renderer.load_snapshot()
+            renderer.warm_assets()
+            # Keep the collector from writing to the warm objects' headers,
+            # which would unshare their pages in every worker.
+            gc.freeze()
+        self.processes = [self._spawn() for _ in range(workers)]
+
+    def _spawn(self):
+        process = self.ctx.Process(
+            target=worker_loop,
+            args=(
+                self.jobs,
+                self.results,
+                self.started,
+                self.max_jobs,
+                self.handler,
+                not self.forked,
+            ),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def _read_started(self):
+        while not self.started.empty():
+            uid, pid = self.started.get()
+            self.running[pid] = uid
+
+    def _replace_exited(self):
+        if self.closing:
+            return
+        self._read_started()
+        for i, process in enumerate(self.processes):
+            if not process.is_alive():
+                process.join()
+                if process.pid in self.running:
+                    uid = self.running.pop(process.pid)
+                    self.orphaned[process.pid] = (uid, process.exitcode)
+                self.processes[i] = self._spawn()
+                self.recycled += 1
+
+    def _fail_orphaned(self):
+        # Anything a dead worker sent was in the queue before it exited, so
+        # a job it still hasn't answered after a full drain is lost.
+        for pid, (uid, exitcode) in self.orphaned.items():
+            error = f"worker exited with code {exitcode} mid-job"
+            self.lost.append((uid, pid, None, error))
+        self.orphaned = {}
+
+    def submit(self, job):
+        self.jobs.put(job)
+
+    def get_result(self, timeout=None):
+        """
+        Next (uid, worker_pid, result, error) tuple, or None once `timeout`
+        seconds pass without one. Exited workers are replaced while waiting.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while deadline is None or time.monotonic() < deadline:
+            if self.lost:
+                return self.lost.popleft()
+            try:
+                item = self.results.get(timeout=0.5)
+            except queue.Empty:
+                self._fail_orphaned()
+                self._replace_exited()
+                continue
+            # The worker wrote its started record before this result.
+            self._read_started()
+            self.running.pop(item[1], None)
+            self.orphaned.pop(item[1], None)
+            return item
+        return None
+
+    def map(self, jobs):
+        jobs = list(jobs)
+        for job in jobs:
+            self.submit(job)
+        return [self.get_result() for _ in jobs]
+
+    def close(self):
+        self.closing = True
+        for _ in self.processes:
+            self.jobs.put(None)
+        for process in self.processes:
+            process.join()
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    max_jobs = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    split = sys.argv[3:4] == ["split"]
+
+    pool = WarmPool(workers, max_jobs, render_to_spool if split else handle_job)
+    uploads = ThreadPoolExecutor(max_workers=8, thread_name_prefix="upload")
+    print(f"Started {workers} warm workers (recycled every {max_jobs} jobs).")
+
+    submitted = 0
+    done = threading.Event()
+
+    def report(uid, pid, result, error):
+        print(
+            json.dumps({"uid": uid, "worker": pid, "result": result, "error": error}),
+            flush=True,
+        )
+
+    def upload_and_report(uid, pid, path):
+        try:
+            report(uid, pid, upload_spooled(uid, path), None)
+        except Exception as e:
+            report(uid, pid, None, repr(e))
+
+    def print_results():
+        printed = 0
+        while not (done.is_set() and printed == submitted):
+            item = pool.get_result(timeout=1)
+            if item is None:
+                continue
+            uid, pid, result, error = item
+            if split and error is None:
+                uploads.submit(upload_and_report, uid, pid, result)
+            else:
+                report(uid, pid, result, error)
+            printed += 1
+
+    printer = threading.Thread(target=print_results)
+    printer.start()
+    for line in sys.stdin:
+        if line.strip():
+            pool.submit(json.loads(line))
+            submitted += 1
+    done.set()
+    printer.join()
+    uploads.shutdown()
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Sampling profiler for one render job.
+
+A background thread snapshots every thread's Python stack at a fixed
+interval (sys._current_frames), so band workers, the I/O pool and the event
+loop are all covered, not just the calling thread. Threads parked in an idle
+pool or in the event loop's select() are skipped.
+
+Writes two files:
+    <name>.collapsed    one "frame;frame;frame count" line per stack, the
+                        input format of flamegraph.pl, speedscope and inferno
+    <name>-summary.txt  samples per renderer stage, with each stage's
+                        top-N leaf functions
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+# (stage, file suffix, function name). A sample belongs to the stage of its
+# outermost matching frame, so e.g. a LANCZOS resize inside load_badge counts
+# as badge loading.
+STAGES = [
+    ("wrap_text", "renderer.py", "wrap_text"),
+    ("wrap_text", "renderer.py", "wrap_text_by_width"),
+    ("Pilmoji.getsize", os.path.join("pilmoji", "core.py"), "getsize"),
+    ("Pilmoji.text", os.path.join("pilmoji", "core.py"), "text"),
+    ("badge loading", "renderer.py", "load_badge"),
+    ("avatars", "renderer.py", "fetch_avatar"),
+    ("http", "transport.py", "request"),
+    ("alpha_composite", os.path.join("PIL", "Image.py"), "alpha_composite"),
+    ("resize", os.path.join("PIL", "Image.py"), "resize"),
+    ("save", os.path.join("PIL", "Image.py"), "save"),
+    ("waiting", "threading.py", "wait"),
+]
+
+# Innermost frames of threads with nothing to do.
+IDLE = [
+    (os.path.join("concurrent", "futures", "thread.py"), "_worker"),
+    ("selectors.py", "select"),
+]
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)})"
+
+
+def matches(code, suffix, name):
+    return code.co_name == name and code.co_filename.endswith(suffix)
+
+
+def stage_of(codes):
+    """Stage of a stack given outermost-first, or "other"."""
+    for code in codes:
+        for stage, suffix, name in STAGES:
+            if matches(code, suffix, name):
+                return stage
+    return "other"
+
+
+class Sampler:
+    """Context manager that samples all threads every `interval` seconds."""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stopping.set()
+        self.thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stopping.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                if any(matches(frame.f_code, *idle) for idle in IDLE):
+                    continue
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.reverse()
+                # Band and pool workers are numbered; keep one name per kind.
+                thread = names.get(ident, "thread").rstrip("_0123456789")
+                self.stacks[(thread, tuple(codes))] += 1
+
+    def write_collapsed(self, path):
+        lines = collections.Counter()
+        for (thread, codes), count in self.stacks.items():
+            lines[";".join([thread, *map(frame_label, codes)])] += count
+        with open(path, "w") as f:
+            for line, count in sorted(lines.items()):
+                f.write(f"{line} {count}\n")
+
+    def summary(self, top=5):
+        """Text report: samples per stage, each with its top `top` leaf functions."""
+        stages = collections.Counter()
+        leaves = collections.defaultdict(collections.Counter)
+        for (_, codes), count in self.stacks.items():
+            stage = stage_of(codes)
+            stages[stage] += count
+            leaves[stage][frame_label(codes[-1])] += count
+
+        total = sum(stages.values()) or 1
+        lines = [
+            f"{total} samples every {self.interval * 1000:g}ms over "
+            f"{self.elapsed:.2f}s (all busy threads; concurrent ones add up)"
+        ]
+        for stage, count in stages.most_common():
+            lines.append(f"{stage:<16} {count:6d} samples {100 * count / total:5.1f}%")
+            for label, leaf_count in leaves[stage].most_common(top):
+                lines.append(f"    {leaf_count:6d}  {label}")
+        return "\n".join(lines)
+
+    def write(self, directory, name, top=5):
+        """Writes <name>.collapsed and <name>-summary.txt; returns the summary."""
+        os.makedirs(directory, exist_ok=True)
+        self.write_collapsed(os.path.join(directory, f"{name}.collapsed"))
+        summary = self.summary(top)
+        with open(os.path.join(directory, f"{name}-summary.txt"), "w") as f:
+            f.write(summary + "\n")
+        return summary
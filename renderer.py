@@ -1,15 +1,35 @@
+import asyncio
+import collections
+import dataclasses
+import functools
+import hashlib
 import io
+import mmap
 import requests
 import praw
+import prawcore
 import enum
 import json
+import math
 import os
+import re
+import shutil
 import sys
+import threading
 import time
+import traceback
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass
-from PIL import Image, ImageDraw, ImageFont, ImageColor
+import PIL
+import pilmoji
+from PIL import Image, ImageDraw, ImageFont, ImageColor, ImageChops
 from pilmoji import Pilmoji
+from pilmoji.helpers import EMOJI_REGEX
 from pilmoji.source import AppleEmojiSource
+from handoff import MultipartStream, SpooledFile, spool_path
+from profiler import Sampler
+from transport import http
 
 try:
     import cloudscraper
@@ -17,11 +37,29 @@ try:
 except ImportError:
     USE_CLOUDSCRAPER = False
 
+try:
+    # NumPy signed-distance rasterizer for bubbles and avatar masks.
+    import shapes
+    USE_SDF = os.environ.get("RENDER_SDF", "1") != "0"
+except ImportError:
+    USE_SDF = False
+
+
+# REDDIT_URL / REDDIT_OAUTH_URL point praw at a local fake Reddit for testing.
+REDDIT_ENDPOINTS = {
+    setting: os.environ[var]
+    for setting, var in (
+        ("reddit_url", "REDDIT_URL"),
+        ("oauth_url", "REDDIT_OAUTH_URL"),
+    )
+    if os.environ.get(var)
+}
 
 reddit = praw.Reddit(
     client_id=os.environ["REDDIT_CLIENT_ID"],
     client_secret=os.environ["REDDIT_SECRET"],
     user_agent="u/textingtheorybot pfp fetcher",
+    **REDDIT_ENDPOINTS,
 )
 
 
@@ -116,16 +154,652 @@ class RedditComment:
     classification: Classification
 
 
+class AvatarResolver:
+    """
+    Resolves Reddit usernames to avatar icon URLs with as few API calls as the
+    API allows, keeping a TTL cache of the results across renders.
+
+    Reddit has no bulk lookup by username, so each unknown user costs one
+    deduplicated /user/<name>/about request. That request also yields the
+    account id, so once entries expire they are refreshed together through
+    /api/user_data_by_account_ids, up to 100 accounts per request.
+
+    With `cache_path` set, the cache is also loaded from and saved to a JSON
+    file so it survives process restarts.
+
+    Safe to call from several threads; `lock` guards `entries` and the file,
+    but isn't held during API calls.
+    """
+
+    BATCH_SIZE = 100
+
+    def __init__(self, reddit_client, ttl=6 * 60 * 60, cache_path=None):
+        self.reddit = reddit_client
+        self.ttl = ttl
+        self.cache_path = cache_path
+        # lowercased username -> [icon_url, account_fullname, expires_at]
+        self.entries = {}
+        self.api_calls = 0
+        self.lock = threading.Lock()
+        if cache_path and os.path.exists(cache_path):
+            try:
+                with open(cache_path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Ignoring unreadable avatar cache {cache_path}: {e}")
+
+    def resolve(self, usernames) -> dict:
+        """Returns {username: icon_url or None} for every distinct username."""
+        now = time.time()
+        usernames = [username for username in usernames if username]
+        names = {username.lower(): username for username in usernames}
+
+        stale_ids, unknown = {}, []
+        with self.lock:
+            for key, username in names.items():
+                entry = self.entries.get(key)
+                if entry and entry[2] > now:
+                    continue
+                if entry and entry[1]:
+                    stale_ids[entry[1]] = key
+                else:
+                    unknown.append(username)
+
+        ids = list(stale_ids)
+        for i in range(0, len(ids), self.BATCH_SIZE):
+            batch = ids[i : i + self.BATCH_SIZE]
+            fetched = {}
+            try:
+                for partial in self.reddit.redditors.partial_redditors(batch):
+                    key = stale_ids.pop(partial.fullname, None)
+                    if key:
+                        icon_url = getattr(partial, "profile_img", None)
+                        fetched[key] = [icon_url, partial.fullname, now + self.ttl]
+            except Exception as e:
+                print(f"Warning: Bulk avatar lookup failed: {e}")
+            else:
+                # Ids the server silently dropped belong to deleted accounts.
+                for fullname in batch:
+                    key = stale_ids.pop(fullname, None)
+                    if key:
+                        fetched[key] = [None, None, now + self.ttl]
+            with self.lock:
+                self.api_calls += 1
+                self.entries.update(fetched)
+
+        for username in unknown:
+            with self.lock:
+                self.api_calls += 1
+            try:
+                redditor = self.reddit.redditor(username)
+                icon_url = redditor.icon_img
+                fullname = redditor.fullname
+            except (prawcore.exceptions.NotFound, prawcore.exceptions.Forbidden):
+                icon_url = fullname = None
+            except AttributeError:
+                # Suspended accounts come back without profile fields.
+                icon_url = fullname = None
+            except Exception as e:
+                print(f"Warning: Could not look up u/{username}: {e}")
+                continue
+            with self.lock:
+                self.entries[username.lower()] = [icon_url, fullname, now + self.ttl]
+
+        if self.cache_path:
+            self.save(now)
+
+        with self.lock:
+            return {
+                username: (self.entries.get(username.lower()) or [None])[0]
+                for username in usernames
+            }
+
+    def usernames(self):
+        """Every cached username."""
+        with self.lock:
+            return list(self.entries)
+
+    def save(self, now=None):
+        now = time.time() if now is None else now
+        # Written beside the cache and swapped in, so a crash or another
+        # process reading it never sees half a file.
+        staging = f"{self.cache_path}.tmp{os.getpid()}"
+        with self.lock:
+            live = {key: entry for key, entry in self.entries.items() if entry[2] > now}
+            try:
+                with open(staging, "w", encoding="utf-8") as f:
+                    json.dump(live, f)
+                os.replace(staging, self.cache_path)
+            except OSError as e:
+                print(f"Warning: Could not write avatar cache {self.cache_path}: {e}")
+
+
+avatar_resolver = AvatarResolver(
+    reddit,
+    ttl=int(os.environ.get("AVATAR_CACHE_TTL", 6 * 60 * 60)),
+    cache_path=os.environ.get("AVATAR_CACHE_PATH"),
+)
+
+
+def _reset_avatar_resolver_lock():
+    # The lock may have been held by an io_pool thread that doesn't exist in
+    # the child.
+    avatar_resolver.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_avatar_resolver_lock)
+
+# Network-bound helpers (avatar, emoji and upload requests) run here so they
+# overlap with layout and drawing.
+io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="render-io")
+
+
+def _reset_io_pool():
+    # A forked child inherits the pool object but none of its threads.
+    global io_pool
+    io_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="render-io")
+
+
+os.register_at_fork(after_in_child=_reset_io_pool)
+
+
+def fetch_avatar(icon_url, size=None):
+    """
+    Downloads one avatar image, resized to size x size when `size` is given;
+    None when it's missing or unusable.
+    """
+    if not icon_url:
+        return None
+    if ("avatar", icon_url, size) in snapshot_assets:
+        return snapshot_assets[("avatar", icon_url, size)]
+    try:
+        response = http.get(icon_url)
+        response.raise_for_status()
+        avatar = Image.open(io.BytesIO(response.content)).convert("RGBA")
+        if size:
+            avatar = avatar.resize((size, size), Image.LANCZOS)
+        return avatar
+    except Exception as e:
+        print(f"Warning: Could not download avatar {icon_url}: {e}")
+        return None
+
+
+def prefetch_avatars(usernames) -> dict:
+    """
+    Starts resolving and downloading every distinct author's avatar on the I/O
+    pool. Returns {username: Future} where each future yields an RGBA image or
+    None, so callers only block on an avatar when they're ready to draw it.
+    Images come at AVATAR_FETCH_SIZE.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    icon_urls = io_pool.submit(avatar_resolver.resolve, usernames)
+    # Authors without a name (deleted accounts) get the placeholder.
+    no_avatar = Future()
+    no_avatar.set_result(None)
+    return {
+        username: io_pool.submit(
+            lambda username: fetch_avatar(
+                icon_urls.result().get(username), AVATAR_FETCH_SIZE
+            ),
+            username,
+        )
+        if username
+        else no_avatar
+        for username in usernames
+    }
+
+
+class CachedAppleEmojiSource(AppleEmojiSource):
+    """
+    AppleEmojiSource backed by a process-wide cache of emoji image bytes, so
+    each emoji is downloaded once per process rather than once per Pilmoji
+    instance, and can be fetched ahead of time with prefetch_emoji().
+    """
+
+    BASE_EMOJI_CDN_URL = os.environ.get(
+        "EMOJI_CDN_URL", AppleEmojiSource.BASE_EMOJI_CDN_URL
+    )
+    images = {}
+    # Downloads in flight, by emoji, so a render waits for a prefetch of the
+    # same emoji rather than starting a second download.
+    pending = {}
+    lock = threading.Lock()
+
+    def request(self, url):
+        # Through the shared transport instead of a session per instance.
+        response = http.get(url, headers=self.REQUEST_KWARGS["headers"])
+        if response.ok:
+            return response.content
+
+    def get_emoji(self, emoji, /):
+        with self.lock:
+            data = self.images.get(emoji)
+            download = self.pending.get(emoji)
+            owner = data is None and download is None
+            if owner:
+                download = self.pending[emoji] = Future()
+        if data is None and not owner:
+            data = download.result()
+        elif owner:
+            data = b""
+            try:
+                stream = super().get_emoji(emoji)
+                data = stream.getvalue() if stream is not None else b""
+            finally:
+                # Only successes are cached, so a failed download is retried
+                # by the next render instead of sticking for the process.
+                with self.lock:
+                    if data:
+                        self.images[emoji] = data
+                    del self.pending[emoji]
+                download.set_result(data)
+        return io.BytesIO(data) if data else None
+
+
+def _reset_emoji_downloads():
+    # Downloads in flight belong to threads that don't exist in the child.
+    CachedAppleEmojiSource.pending = {}
+    CachedAppleEmojiSource.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_emoji_downloads)
+
+
+def prefetch_emoji(texts):
+    """Starts downloading every emoji in `texts` that isn't cached yet."""
+    emojis = {match for text in texts for match in EMOJI_REGEX.findall(text)}
+    source = CachedAppleEmojiSource()
+
+    def fetch(emoji):
+        try:
+            source.get_emoji(emoji)
+        except Exception as e:
+            # Pilmoji retries (and reports) anything still missing at draw time.
+            print(f"Warning: Could not prefetch emoji {emoji!r}: {e}")
+
+    return [
+        io_pool.submit(fetch, emoji)
+        for emoji in emojis
+        if not emoji.startswith("<")
+        and emoji not in CachedAppleEmojiSource.images
+        and emoji not in CachedAppleEmojiSource.pending
+    ]
+
+
+# Warm assets. Fonts, badges and masks are cached for the life of the process
+# and shared across renders (and, via copy-on-write, across forked workers),
+# so treat the returned objects as read-only.
+
+# Emoji prefetched by warm_assets(); defaults to the most common ones on the sub.
+COMMON_EMOJI = os.environ.get("WARM_EMOJI", "😂😭🤣💀😅🙏😊🥺😍❤️🔥👍😩🤔😳🙄😘💯😎✨")
+
+# (size, resample) of every badge variant the renderers draw.
+BADGE_VARIANTS = (
+    (36 * 4, None),  # render_conversation
+    (144, Image.LANCZOS),  # render_reddit_chain
+)
+
+# Size render_reddit_chain draws avatars at.
+CHAIN_AVATAR_SIZE = 136
+# Size avatars are downloaded (and snapshotted) at. With the SDF mask they go
+# straight to their final size, so that resize happens on the I/O pool; the
+# supersampled path scales the source to 4x and needs it whole.
+AVATAR_FETCH_SIZE = CHAIN_AVATAR_SIZE if USE_SDF else None
+
+# Images loaded from a warm snapshot, keyed like ("badge", path, size, resample)
+# or ("avatar", icon_url, size). They're backed by the snapshot's memory map,
+# so read-only.
+snapshot_assets = {}
+
+
+def badge_paths():
+    """Every existing badge file, once; most classifications ignore the color."""
+    paths = {
+        classification.png_path(color)
+        for classification in Classification
+        for color in ("white", "black")
+    }
+    return sorted(path for path in paths if os.path.exists(path))
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(path, size):
+    """
+    Shared FreeType font. Safe across band threads: Pillow's FreeType calls
+    hold the GIL, so no two run on one face at once.
+    """
+    return ImageFont.truetype(path, size)
+
+
+@functools.lru_cache(maxsize=None)
+def load_badge(path, size, resample=None):
+    """Decoded RGBA badge resized to size x size."""
+    if ("badge", path, size, resample) in snapshot_assets:
+        return snapshot_assets[("badge", path, size, resample)]
+    badge = Image.open(path)
+    if badge.mode != "RGBA":
+        badge = badge.convert("RGBA")
+    return badge.resize((size, size), resample)
+
+
+@functools.lru_cache(maxsize=None)
+def avatar_mask(size):
+    """
+    Antialiased circular mask, from its distance field, or drawn at 4x and
+    downsampled without NumPy.
+    """
+    if USE_SDF:
+        return shapes.circle_mask(size)
+    mask_hires = Image.new("L", (size * 4, size * 4), 0)
+    ImageDraw.Draw(mask_hires).ellipse((0, 0, size * 4, size * 4), fill=255)
+    return mask_hires.resize((size, size), Image.LANCZOS)
+
+
+def warm_assets(emoji=COMMON_EMOJI):
+    """
+    Loads everything the renderers would otherwise load lazily on their first
+    job: fonts, glyph metric tables, every Classification badge variant at
+    the sizes both renderers draw, the avatar mask and a set of emoji images.
+    """
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    printable = "".join(chr(cp) for cp in range(0x20, 0x7F))
+    for path, size in (
+        ("fonts/Inter.ttf", 14 * 4),  # render_conversation
+        ("fonts/Inter Bold.ttf", 56),  # render_reddit_chain usernames
+        ("fonts/Inter.ttf", 64),  # render_reddit_chain text
+    ):
+        text_bbox(draw, printable, load_font(path, size))
+
+    for badge_path in badge_paths():
+        for size, resample in BADGE_VARIANTS:
+            load_badge(badge_path, size, resample)
+    avatar_mask(CHAIN_AVATAR_SIZE)
+
+    for future in prefetch_emoji([emoji]):
+        future.result()
+
+
+# Warm snapshot. `renderer.py warm` saves the warm assets to a versioned
+# directory (a manifest plus one data file), which later runs memory-map
+# instead of decoding badges, downloading emoji and avatars, and measuring
+# glyphs again. Bump SNAPSHOT_VERSION whenever the stored format changes.
+SNAPSHOT_VERSION = 2
+SNAPSHOT_DIR = os.environ.get("RENDER_CACHE_DIR", ".render-cache")
+
+
+def snapshot_fingerprint():
+    """Hash of everything a snapshot's contents depend on."""
+    digest = hashlib.sha256(
+        f"{SNAPSHOT_VERSION}|{PIL.__version__}|{pilmoji.__version__}|"
+        f"{CachedAppleEmojiSource.BASE_EMOJI_CDN_URL}|{BADGE_VARIANTS}".encode()
+    )
+    for folder in ("fonts", "badges"):
+        for name in sorted(os.listdir(folder)):
+            digest.update(name.encode())
+            with open(os.path.join(folder, name), "rb") as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def snapshot_path(directory=SNAPSHOT_DIR):
+    return os.path.join(directory, f"v{SNAPSHOT_VERSION}")
+
+
+def write_snapshot(directory=SNAPSHOT_DIR, usernames=()):
+    """
+    Warms every asset, plus the avatars of `usernames` and of everyone in
+    the avatar cache, and writes them all as a snapshot under `directory`.
+    """
+    warm_assets()
+    draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+    # Every character text_bbox measures from the tables (see needs_shaping).
+    table_chars = "".join(
+        chr(cp)
+        for cp in (*range(0x20, 0x250), *range(0x2010, 0x2028), *range(0x2030, 0x205F))
+        if chr(cp).isprintable()
+    )
+    for key in list(_glyph_metrics):
+        text_bbox(draw, table_chars, load_font(key[0], key[1]))
+
+    entries, chunks, offset = [], [], 0
+
+    def add(entry, data):
+        nonlocal offset
+        entries.append(
+            {**entry, "offset": offset, "length": len(data), "crc": zlib.crc32(data)}
+        )
+        chunks.append(data)
+        offset += len(data)
+
+    for badge_path in badge_paths():
+        for size, resample in BADGE_VARIANTS:
+            add(
+                {
+                    "kind": "badge",
+                    "path": badge_path,
+                    "size": size,
+                    "resample": None if resample is None else int(resample),
+                },
+                load_badge(badge_path, size, resample).tobytes(),
+            )
+
+    for emoji, data in list(CachedAppleEmojiSource.images.items()):
+        # A failed download has no image to store; it's retried at render time.
+        if data:
+            add({"kind": "emoji", "emoji": emoji}, bytes(data))
+
+    usernames = [*usernames, *avatar_resolver.usernames()]
+    for username, icon_url in avatar_resolver.resolve(usernames).items():
+        avatar = fetch_avatar(icon_url, AVATAR_FETCH_SIZE)
+        if avatar is not None:
+            add(
+                {
+                    "kind": "avatar",
+                    "url": icon_url,
+                    "scaled": AVATAR_FETCH_SIZE,
+                    "size": list(avatar.size),
+                },
+                avatar.tobytes(),
+            )
+
+    for (path, size, index), metrics in _glyph_metrics.items():
+        tables = {"advances": metrics.advances, "boxes": metrics.boxes}
+        add(
+            {"kind": "metrics", "path": path, "size": size, "index": index},
+            json.dumps(tables).encode(),
+        )
+
+    # Write next to the live snapshot and swap it in, so a reader never sees
+    # a half-written one.
+    target = snapshot_path(directory)
+    staging = f"{target}.tmp{os.getpid()}"
+    os.makedirs(staging, exist_ok=True)
+    with open(os.path.join(staging, "assets.bin"), "wb") as f:
+        f.writelines(chunks)
+    manifest = {
+        "version": SNAPSHOT_VERSION,
+        "fingerprint": snapshot_fingerprint(),
+        "created": time.time(),
+        "size": offset,
+        "entries": entries,
+    }
+    with open(os.path.join(staging, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    if os.path.exists(target):
+        os.rename(target, f"{staging}.old")
+    os.rename(staging, target)
+    shutil.rmtree(f"{staging}.old", ignore_errors=True)
+
+    counts = {}
+    for entry in entries:
+        counts[entry["kind"]] = counts.get(entry["kind"], 0) + 1
+    print(f"Wrote snapshot {target}: {offset / 1024:.0f} KiB, {counts}")
+
+
+def load_snapshot(directory=SNAPSHOT_DIR) -> bool:
+    """
+    Memory-maps the snapshot under `directory` and installs its assets.
+    A missing, stale (fonts, badges or library versions changed) or corrupt
+    snapshot is ignored with a warning; returns whether one was loaded.
+    """
+    target = snapshot_path(directory)
+    try:
+        with open(os.path.join(target, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        data_file = open(os.path.join(target, "assets.bin"), "rb")
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError) as e:
+        print(f"Warning: Ignoring unreadable snapshot {target}: {e}")
+        return False
+
+    with data_file:
+        if manifest.get("fingerprint") != snapshot_fingerprint():
+            print(f"Warning: Ignoring stale snapshot {target}")
+            return False
+        if os.fstat(data_file.fileno()).st_size != manifest["size"]:
+            print(f"Warning: Ignoring truncated snapshot {target}")
+            return False
+        if manifest["size"] == 0:
+            return True
+        view = memoryview(mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+    entries = []
+    for entry in manifest["entries"]:
+        data = view[entry["offset"] : entry["offset"] + entry["length"]]
+        if zlib.crc32(data) != entry["crc"]:
+            print(f"Warning: Ignoring corrupt snapshot {target}")
+            return False
+        entries.append((entry, data))
+
+    for entry, data in entries:
+        kind = entry["kind"]
+        if kind == "badge":
+            size = entry["size"]
+            snapshot_assets[("badge", entry["path"], size, entry["resample"])] = (
+                Image.frombuffer("RGBA", (size, size), data, "raw", "RGBA", 0, 1)
+            )
+        elif kind == "avatar":
+            size = tuple(entry["size"])
+            key = ("avatar", entry["url"], entry["scaled"])
+            snapshot_assets[key] = Image.frombuffer(
+                "RGBA", size, data, "raw", "RGBA", 0, 1
+            )
+        elif kind == "emoji" and len(data):
+            CachedAppleEmojiSource.images.setdefault(entry["emoji"], data)
+        elif kind == "metrics":
+            key = (entry["path"], entry["size"], entry["index"])
+            font = load_font(entry["path"], entry["size"])
+            _glyph_metrics[key] = GlyphMetrics(font, json.loads(bytes(data)))
+    print(f"Loaded snapshot {target} ({len(entries)} assets)")
+    return True
+
+
+def needs_shaping(text: str) -> bool:
+    """
+    True when `text` holds anything the BASIC layout engine can't place on its
+    own: right-to-left scripts, combining marks, joiners (ZWJ emoji sequences),
+    variation selectors, or any character outside Latin-1 / Latin Extended and
+    the general punctuation block.
+    """
+    if text.isascii():
+        return False
+    for char in text:
+        cp = ord(char)
+        if cp <= 0x024F or 0x2010 <= cp <= 0x2027 or 0x2030 <= cp <= 0x205E:
+            continue
+        return True
+    return False
+
+
+class GlyphMetrics:
+    """
+    Per-character advance and ink-box tables for one font under the BASIC
+    layout engine. Unshaped text is measured by walking the table instead of
+    laying out the whole string again in FreeType.
+    """
+
+    def __init__(self, font: ImageFont.FreeTypeFont, tables=None):
+        self.font = ImageFont.truetype(
+            font.path,
+            font.size,
+            index=font.index,
+            layout_engine=ImageFont.Layout.BASIC,
+        )
+        self.draw = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+        # Prefilled from a warm snapshot when `tables` is given.
+        self.advances = dict(tables["advances"]) if tables else {}
+        self.boxes = (
+            {char: tuple(box) for char, box in tables["boxes"].items()}
+            if tables
+            else {}
+        )
+        # BASIC applies legacy 'kern' table pairs, which per-character sums
+        # can't reproduce. Inter only kerns through GPOS, but check anyway.
+        probe = "AVTaWoYo"
+        self.additive = self.font.getlength(probe) == sum(
+            self.font.getlength(char) for char in probe
+        )
+
+    def bbox(self, text: str, anchor: str = None) -> tuple[int, int, int, int]:
+        pen = 0
+        x0 = y0 = x1 = y1 = None
+        for char in text:
+            if char not in self.advances:
+                self.advances[char] = self.font.getlength(char)
+                self.boxes[char] = self.draw.textbbox((0, 0), char, font=self.font)
+            box = self.boxes[char]
+            x0 = pen + box[0] if x0 is None else min(x0, pen + box[0])
+            x1 = pen + box[2] if x1 is None else max(x1, pen + box[2])
+            y0 = box[1] if y0 is None else min(y0, box[1])
+            y1 = box[3] if y1 is None else max(y1, box[3])
+            pen += self.advances[char]
+
+        x0, x1 = int(x0), int(max(x1, pen))
+        if anchor == "lt":
+            return x0, 0, x1, y1 - y0
+        return x0, y0, x1, y1
+
+
+_glyph_metrics = {}
+
+
+def text_bbox(draw, text, font, anchor=None):
+    """
+    Drop-in for `draw.textbbox((0, 0), text, font=font, anchor=anchor)`.
+    Single-line text that doesn't need shaping, in a font laid out with
+    BASIC, is measured from cached layout tables. Everything else goes
+    through the font's own layout engine. That includes every font when
+    Pillow has raqm, since raqm applies Inter's GPOS kerning, which the
+    tables can't reproduce.
+    """
+    if (
+        text
+        and anchor in (None, "la", "lt")
+        and "\n" not in text
+        and isinstance(font, ImageFont.FreeTypeFont)
+        and font.layout_engine == ImageFont.Layout.BASIC
+        and not needs_shaping(text)
+    ):
+        key = (font.path, font.size, font.index)
+        if key not in _glyph_metrics:
+            _glyph_metrics[key] = GlyphMetrics(font)
+        metrics = _glyph_metrics[key]
+        if metrics.additive:
+            return metrics.bbox(text, anchor)
+    return draw.textbbox((0, 0), text, font=font, anchor=anchor)
+
+
 def wrap_text(text, draw, font, max_width):
     def ellipsize(word):
         ellipsis = "..."
-        ellipsis_width = draw.textbbox((0, 0), ellipsis, font=font)[2]
+        ellipsis_width = text_bbox(draw, ellipsis, font)[2]
         if ellipsis_width > max_width:
             return ""
         truncated = ""
         for char in word:
             test_word = truncated + char + ellipsis
-            test_width = draw.textbbox((0, 0), test_word, font=font)[2]
+            test_width = text_bbox(draw, test_word, font)[2]
             if test_width <= max_width:
                 truncated += char
             else:
@@ -137,11 +811,11 @@ def wrap_text(text, draw, font, max_width):
         words = para.split(" ")
         line = ""
         for w in words:
-            w_width = draw.textbbox((0, 0), w, font=font)[2]
+            w_width = text_bbox(draw, w, font)[2]
             if w_width > max_width:
                 w = ellipsize(w)
             test_line = (line + " " + w).strip()
-            test_box = draw.textbbox((0, 0), test_line, font=font)
+            test_box = text_bbox(draw, test_line, font)
             if test_box[2] - test_box[0] <= max_width:
                 line = test_line
             else:
@@ -205,18 +879,448 @@ def wrap_text_by_width(text: str, font, max_width: int, measure_fn) -> list[str]
     return lines
 
 
+# Short lines ("lol", "ok", "???", a lone emoji) repeat constantly across
+# payloads. Their rasters are cached and blitted instead of being shaped and
+# rasterized again; the cache lives as long as the process, so batch and
+# server modes keep it across jobs.
+TEXT_CACHE_BYTES = int(os.environ.get("TEXT_CACHE_BYTES", str(32 << 20)))
+# Longer lines rarely repeat, so they're drawn directly.
+TEXT_CACHE_MAX_CHARS = 40
+# Counted against the budget for every entry, so entries that hold nothing
+# (lines that can't be blitted) still age out.
+TEXT_CACHE_ENTRY_OVERHEAD = 256
+
+
+class RasterCache:
+    """
+    Thread-safe LRU of rendered text rasters, bounded by the pixel bytes it
+    holds (`max_bytes`) rather than the entry count. Keeps hit, miss and
+    eviction counts for report().
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = self.misses = self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, render):
+        """The raster cached under `key`, from render() on a miss."""
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        # Rendered outside the lock so band threads don't wait on each other;
+        # two threads missing the same key both render it, which is harmless.
+        entry = render()
+        size = TEXT_CACHE_ENTRY_OVERHEAD + sum(
+            image.width * image.height * len(image.getbands())
+            for image in entry
+            if isinstance(image, Image.Image)
+        )
+        with self.lock:
+            if key not in self.entries and size <= self.max_bytes:
+                self.entries[key] = entry
+                self.sizes[key] = size
+                self.bytes += size
+                while self.bytes > self.max_bytes:
+                    evicted, _ = self.entries.popitem(last=False)
+                    self.bytes -= self.sizes.pop(evicted)
+                    self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+            }
+
+    def report(self):
+        stats = self.stats()
+        print(
+            f"Text cache: {100 * stats['hit_rate']:.1f}% hits "
+            f"({stats['hits']}/{stats['hits'] + stats['misses']}), "
+            f"{stats['entries']} entries, {stats['bytes'] / (1 << 20):.1f} MiB, "
+            f"{stats['evictions']} evicted"
+        )
+
+
+text_cache = RasterCache(TEXT_CACHE_BYTES)
+
+
+def _reset_text_cache_lock():
+    # The lock may have been held by a band thread that doesn't exist in the
+    # child; the entries themselves are consistent under the GIL.
+    text_cache.lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_text_cache_lock)
+
+
+def font_key(font):
+    """Identifies a FreeType font by file and size; None for other fonts."""
+    if isinstance(font, ImageFont.FreeTypeFont):
+        return font.path, font.size, font.index
+    return None
+
+
+def draw_text_line(canvas, draw, xy, text, font, fill):
+    """
+    `draw.text(xy, text, font=font, fill=fill, anchor="lt")` on `canvas` at
+    integer `xy`, blitting the line's coverage mask from text_cache when it's
+    short. The mask is colorless, so a line is cached once whatever color
+    it's drawn in, and pasting the fill color through it blends exactly like
+    draw.text does.
+    """
+    key = font_key(font)
+    if key is None or len(text) > TEXT_CACHE_MAX_CHARS:
+        draw.text(xy, text, font=font, fill=fill, anchor="lt")
+        return
+
+    def render():
+        left, top, right, bottom = font.getbbox(text, anchor="lt")
+        if right <= left or bottom <= top:
+            return None, None
+        mask = Image.new("L", (right - left, bottom - top), 0)
+        ImageDraw.Draw(mask).text(
+            (-left, -top), text, font=font, fill=255, anchor="lt"
+        )
+        return (left, top), mask
+
+    offset, mask = text_cache.get(("mask", key, text), render)
+    if mask is not None:
+        canvas.paste(fill, (xy[0] + offset[0], xy[1] + offset[1]), mask)
+
+
+def flat_interior(size, radius):
+    """
+    Rectangles (inclusive, relative to the shape) that lie wholly inside a
+    size[0] x size[1] rounded rectangle, clear of its corners.
+    """
+    w, h = size
+    d = math.ceil(radius * (1 - 1 / math.sqrt(2))) + 1
+    return [
+        (radius + 1, 1, w - radius - 1, h - 1),
+        (1, radius + 1, w - 1, h - radius - 1),
+        (d, d, w - d, h - d),
+    ]
+
+
+def draw_bubble_text(pilmoji, bubble, radius, background, xy, text, **kwargs):
+    """
+    `pilmoji.text(xy, text, **kwargs)` for text on a bubble filled with one
+    `background` color, covering `bubble` (x0, y0, x1, y1) with corners of
+    `radius`. Short single lines are blitted from text_cache as tiles already
+    blended onto the background, so a hit is one paste: no shaping, glyph
+    rasterizing, or emoji decoding and resizing. A tile is only used when
+    everything the line draws stays clear of the bubble's corners and edges
+    (a row of emoji can spill out of its bubble); otherwise the text is drawn
+    directly.
+    """
+    font = kwargs.get("font")
+    if (
+        font_key(font) is None
+        or "\n" in text
+        or len(text) > TEXT_CACHE_MAX_CHARS
+    ):
+        pilmoji.text(xy, text, **kwargs)
+        return
+
+    x0, y0, x1, y1 = bubble
+    size = (x1 - x0 + 1, y1 - y0 + 1)
+    origin = (xy[0] - x0, xy[1] - y0)
+
+    def render():
+        # One pixel of margin, so anything drawn past the bubble shows up.
+        tile = Image.new("RGBA", (size[0] + 2, size[1] + 2), background)
+        with Pilmoji(tile, source=CachedAppleEmojiSource) as tile_pilmoji:
+            tile_pilmoji.text((origin[0] + 1, origin[1] + 1), text, **kwargs)
+        # Every pixel the text changed, alpha included (RGBA getbbox only
+        # looks at alpha).
+        blank = Image.new("RGBA", tile.size, background)
+        changed = ImageChops.difference(tile, blank).split()
+        boxes = [box for box in map(Image.Image.getbbox, changed) if box]
+        if not boxes:
+            return None, None
+        left, top, right, bottom = (
+            min(box[0] for box in boxes),
+            min(box[1] for box in boxes),
+            max(box[2] for box in boxes),
+            max(box[3] for box in boxes),
+        )
+        # Inclusive box of changed pixels, relative to the bubble.
+        bx0, by0, bx1, by1 = left - 1, top - 1, right - 2, bottom - 2
+        if not any(
+            bx0 >= fx0 and by0 >= fy0 and bx1 <= fx1 and by1 <= fy1
+            for fx0, fy0, fx1, fy1 in flat_interior(size, radius)
+        ):
+            return None, None
+        return (bx0, by0), tile.crop((left, top, right, bottom))
+
+    key = (
+        "tile",
+        font_key(font),
+        text,
+        background,
+        size,
+        origin,
+        radius,
+        tuple(sorted((k, v) for k, v in kwargs.items() if k != "font")),
+    )
+    offset, tile = text_cache.get(key, render)
+    if tile is None:
+        pilmoji.text(xy, text, **kwargs)
+    else:
+        pilmoji.image.paste(tile, (x0 + offset[0], y0 + offset[1]))
+
+
+@dataclass
+class RenderLimits:
+    """
+    Admission limits for untrusted payloads. Every field can be overridden
+    with a RENDER_<FIELD> environment variable, e.g. RENDER_MAX_MESSAGES=100.
+    """
+
+    # Past these the job is rejected outright.
+    reject_messages: int = 2000
+    reject_total_chars: int = 500_000
+    # Checked after truncation, since it may drop enough lines to fit.
+    reject_lines: int = 1500
+    # Past these the job is truncated.
+    max_messages: int = 150
+    max_message_chars: int = 4000
+    max_unbroken_run: int = 300
+    # Past these the job is rendered in the cheaper mode.
+    downgrade_lines: int = 600
+    downgrade_emoji: int = 400
+    # Tallest canvas a renderer may allocate, checked once layout knows the
+    # real height; a backstop for payloads the line estimate undercounts.
+    max_canvas_height: int = 100_000
+    # Wall-clock budget for layout and drawing.
+    deadline_seconds: float = 90.0
+
+    @classmethod
+    def from_env(cls):
+        overrides = {}
+        for field in dataclasses.fields(cls):
+            value = os.environ.get(f"RENDER_{field.name.upper()}")
+            if value:
+                overrides[field.name] = type(field.default)(value)
+        return cls(**overrides)
+
+
+@dataclass
+class CostEstimate:
+    messages: int
+    total_chars: int
+    longest_run: int
+    emoji: int
+    lines: int
+
+
+# Rough characters per wrapped line, used only to estimate canvas height.
+ESTIMATED_CHARS_PER_LINE = 30
+# The only characters wrap_text and wrap_text_by_width break lines at; NBSP,
+# tabs and other whitespace stay inside an unbreakable run.
+WRAP_BREAKS = re.compile("[ \n]")
+
+
+def estimate_cost(messages) -> CostEstimate:
+    """
+    Pure-Python worst-case cost of rendering `messages`, computed without
+    touching Pillow: the long spaceless runs drive the wrappers' per-character
+    measuring loops, and lines drive canvas height.
+    """
+    total_chars = longest_run = emoji = lines = 0
+    for m in messages:
+        content = m.content
+        total_chars += len(content)
+        longest_run = max(longest_run, max(map(len, WRAP_BREAKS.split(content))))
+        if not content.isascii():
+            emoji += len(EMOJI_REGEX.findall(content))
+        lines += content.count("\n") + 1 + len(content) // ESTIMATED_CHARS_PER_LINE
+    return CostEstimate(len(messages), total_chars, longest_run, emoji, lines)
+
+
+@dataclass
+class Admission:
+    action: str  # "accept", "truncate", "downgrade" or "reject"
+    reason: str
+    messages: list
+    cost: CostEstimate
+
+
+def truncate_messages(messages, limits):
+    """Caps message count, message length and unbroken runs, marking cuts with …"""
+    long_run = re.compile(r"[^ \n]{%d,}" % (limits.max_unbroken_run + 1))
+    truncated = []
+    for m in messages[: limits.max_messages]:
+        content = long_run.sub(
+            lambda run: run.group(0)[: limits.max_unbroken_run] + "…", m.content
+        )
+        if len(content) > limits.max_message_chars:
+            content = content[: limits.max_message_chars] + "…"
+        truncated.append(dataclasses.replace(m, content=content))
+    return truncated
+
+
+def admit(messages, limits: RenderLimits) -> Admission:
+    """Decides, before any Pillow work, whether and how to render `messages`."""
+    cost = estimate_cost(messages)
+    if cost.messages > limits.reject_messages:
+        return Admission("reject", f"{cost.messages} messages", [], cost)
+    if cost.total_chars > limits.reject_total_chars:
+        return Admission("reject", f"{cost.total_chars} characters", [], cost)
+
+    action, reasons = "accept", []
+    if (
+        cost.messages > limits.max_messages
+        or cost.longest_run > limits.max_unbroken_run
+        or any(len(m.content) > limits.max_message_chars for m in messages)
+    ):
+        messages = truncate_messages(messages, limits)
+        action = "truncate"
+        reasons.append(
+            f"{cost.messages} messages, longest unbroken run {cost.longest_run}"
+        )
+        cost = estimate_cost(messages)
+
+    if cost.lines > limits.reject_lines:
+        return Admission("reject", f"~{cost.lines} lines", [], cost)
+
+    if cost.lines > limits.downgrade_lines or cost.emoji > limits.downgrade_emoji:
+        action = "downgrade"
+        reasons.append(f"~{cost.lines} lines, {cost.emoji} emoji")
+
+    return Admission(action, "; ".join(reasons) or "within limits", messages, cost)
+
+
+def check_deadline(deadline):
+    """Raises TimeoutError once the time.monotonic() `deadline` has passed."""
+    if deadline is not None and time.monotonic() > deadline:
+        raise TimeoutError("Render deadline exceeded")
+
+
+def check_height(height, max_height):
+    """Raises ValueError, before anything is allocated, for too tall a canvas."""
+    if max_height is not None and height > max_height:
+        raise ValueError(f"Canvas would be {height} px tall (limit {max_height})")
+
+
+def split_bands(tops, total_h, band_count):
+    """
+    Groups consecutive messages into at most `band_count` horizontal bands of
+    roughly equal height. Cuts only fall on message boundaries, so no bubble,
+    badge or line of text ever straddles two bands.
+
+    Returns a list of (start_index, end_index, band_top, band_bottom).
+    """
+    n = len(tops)
+    band_count = max(1, min(band_count, n))
+    starts = [0]
+    for i in range(1, n):
+        if len(starts) < band_count and tops[i] >= total_h * len(starts) / band_count:
+            starts.append(i)
+
+    bands = []
+    for k, start in enumerate(starts):
+        end = starts[k + 1] if k + 1 < len(starts) else n
+        band_top = 0 if k == 0 else tops[start]
+        band_bottom = tops[end] if end < n else total_h
+        bands.append((start, end, band_top, band_bottom))
+    return bands
+
+
+def render_bands(bands, draw_band, workers):
+    """
+    Draws every band with `draw_band` and returns the images in band order.
+    With more than one worker the bands are drawn on a thread pool. Pillow
+    releases the GIL in paste, resize and alpha compositing, so those overlap
+    between bands; text rasterization holds it and runs one band at a time.
+    """
+    if workers <= 1 or len(bands) == 1:
+        return [draw_band(*band) for band in bands]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(lambda band: draw_band(*band), bands))
+
+
+def stitch_bands(bands, band_images, size, mode):
+    """Pastes rendered bands back into one canvas of `size`."""
+    if len(band_images) == 1:
+        return band_images[0]
+    canvas = Image.new(mode, size)
+    for (_, _, band_top, _), band_img in zip(bands, band_images):
+        canvas.paste(band_img, (0, band_top))
+    return canvas
+
+
+# Output sizes a job can ask for, largest first, with each one's downscale
+# factor from the full canvas.
+OUTPUT_SIZES = {"full": 1, "half": 2, "thumb": 4}
+
+
+def output_variant(output_path, name):
+    """Where size `name` of `output_path` goes: "out.png" -> "out.half.png"."""
+    if name == "full":
+        return output_path
+    root, ext = os.path.splitext(output_path)
+    return f"{root}.{name}{ext}"
+
+
+def save_outputs(image, output_path, sizes=("full",)) -> dict:
+    """
+    Saves `image` at each of `sizes` (names from OUTPUT_SIZES) and returns
+    {name: path}. Smaller sizes come from successive Image.reduce() steps on
+    the previous one, box-averaging 2x2 blocks, so every step only touches
+    the pixels of the size above it.
+    """
+    unknown = [name for name in sizes if name not in OUTPUT_SIZES]
+    if unknown:
+        raise ValueError(f"Unknown output size(s): {', '.join(unknown)}")
+
+    paths, factor = {}, 1
+    for name in sorted(set(sizes), key=OUTPUT_SIZES.get):
+        target = OUTPUT_SIZES[name]
+        if target > factor:
+            image = image.reduce(target // factor)
+            factor = target
+        paths[name] = output_variant(output_path, name)
+        image.save(paths[name])
+    return paths
+
+
 def render_conversation(
     messages: list[TextMessage],
     color_data_left,
     color_data_right,
     background_hex,
     output_path="output.png",
-):
+    workers: int = 1,
+    scale: int = 4,
+    deadline: float = None,
+    max_height: int = None,
+    sizes=("full",),
+) -> dict:
     base_w = 320
-    scale = 4
     img_w = base_w * scale
 
-    font = ImageFont.truetype("fonts/Inter.ttf", 14 * scale)
+    font = load_font("fonts/Inter.ttf", 14 * scale)
     pad = 12 * scale
     line_sp = 6 * scale
     radius = 16 * scale
@@ -228,15 +1332,18 @@ def render_conversation(
     dummy = Image.new("RGB", (1, 1))
     dd = ImageDraw.Draw(dummy)
     wrapped, dims = [], []
-    with Pilmoji(dummy, source=AppleEmojiSource) as pilmoji:
+    with Pilmoji(dummy, source=CachedAppleEmojiSource) as pilmoji:
         for m in messages:
+            check_deadline(deadline)
             txt = wrap_text(m.content, dd, font, max_bubble_w - 2 * pad)
             wrapped.append(txt)
             w, h = pilmoji.getsize(txt, font=font, spacing=line_sp)
             dims.append((w, h))
 
+    tops = []
     total_h = pad
     for i, (w, h) in enumerate(dims):
+        tops.append(total_h)
         bh = h + 2 * pad
         total_h += bh
         if i < len(dims) - 1:
@@ -247,177 +1354,200 @@ def render_conversation(
             )
             total_h += next_spacing
     total_h += pad
+    check_height(total_h, max_height)
 
     bg_rgba = ImageColor.getcolor(background_hex, "RGBA")
-    img_bg = Image.new("RGBA", (img_w, total_h), bg_rgba)
-    bubble_layer = Image.new("RGBA", (img_w, total_h), (0, 0, 0, 0))
-    text_drawings = []
-    y = pad
     text_offset = int(0 * scale)
 
-    for i, (m, txt, (w, h)) in enumerate(zip(messages, wrapped, dims)):
-        bw = w + 2 * pad
-        bh = h + 2 * pad
+    def draw_band(start, end, band_top, band_bottom):
+        band_h = band_bottom - band_top
+        img_bg = Image.new("RGBA", (img_w, band_h), bg_rgba)
+        bubble_layer = Image.new("RGBA", (img_w, band_h), (0, 0, 0, 0))
+        text_drawings = []
 
-        # Determine base colors and positioning based on side
-        if m.side == "left":
-            x0 = pad
-            badge_x = x0 + bw - badge_sz + badge_margin
-            base_bubble_hex = color_data_left["bubble_hex"]
-            text_hex = color_data_left["text_hex"]
-        else:
-            x0 = img_w - bw - pad
-            badge_x = x0 - badge_margin
-            base_bubble_hex = color_data_right["bubble_hex"]
-            text_hex = color_data_right["text_hex"]
-
-        # Get classification color
-        classification_color_hex = (
-            None
-            if m.classification in NO_COLOR_ICONS
-            else ICON_COLORS.get(m.classification)
-        )
+        for i in range(start, end):
+            check_deadline(deadline)
+            m, txt, (w, h) = messages[i], wrapped[i], dims[i]
+            y = tops[i] - band_top
+            bw = w + 2 * pad
+            bh = h + 2 * pad
 
-        # Default to the base bubble color. This will be used if there's no
-        # classification color or if a color string is invalid.
-        final_bubble_color = base_bubble_hex
+            # Determine base colors and positioning based on side
+            if m.side == "left":
+                x0 = pad
+                badge_x = x0 + bw - badge_sz + badge_margin
+                base_bubble_hex = color_data_left["bubble_hex"]
+                text_hex = color_data_left["text_hex"]
+            else:
+                x0 = img_w - bw - pad
+                badge_x = x0 - badge_margin
+                base_bubble_hex = color_data_right["bubble_hex"]
+                text_hex = color_data_right["text_hex"]
+
+            # Get classification color
+            classification_color_hex = (
+                None
+                if m.classification in NO_COLOR_ICONS
+                else ICON_COLORS.get(m.classification)
+            )
 
-        # If a classification color exists, blend it with the base color
-        # to simulate a 50% opacity overlay.
-        if classification_color_hex:
-            try:
-                # Get RGB tuples for the base bubble and the classification overlay
-                base_rgb = ImageColor.getrgb(base_bubble_hex)
-                overlay_rgb = ImageColor.getrgb(classification_color_hex)
-
-                # Alpha value for the overlay (50%)
-                alpha = 0.5
-
-                # Blend each channel: C_out = C_base * (1 - alpha) + C_overlay * alpha
-                # This simulates placing the classification color with 50% opacity over the base color.
-                blended_rgb = tuple(
-                    int(base_comp * (1 - alpha) + overlay_comp * alpha)
-                    for base_comp, overlay_comp in zip(base_rgb, overlay_rgb)
-                )
-                final_bubble_color = blended_rgb
-            except (ValueError, TypeError):
-                # Fallback for invalid color strings (e.g., empty string for 'interesting')
-                print(
-                    f"Warning: Could not parse color for {m.classification}. Using base color."
+            # Default to the base bubble color. This will be used if there's no
+            # classification color or if a color string is invalid.
+            final_bubble_color = base_bubble_hex
+
+            # If a classification color exists, blend it with the base color
+            # to simulate a 50% opacity overlay.
+            if classification_color_hex:
+                try:
+                    # Get RGB tuples for the base bubble and the classification overlay
+                    base_rgb = ImageColor.getrgb(base_bubble_hex)
+                    overlay_rgb = ImageColor.getrgb(classification_color_hex)
+
+                    # Alpha value for the overlay (50%)
+                    alpha = 0.5
+
+                    # Blend each channel: C_out = C_base * (1 - alpha) + C_overlay * alpha
+                    # This simulates placing the classification color with 50% opacity over the base color.
+                    blended_rgb = tuple(
+                        int(base_comp * (1 - alpha) + overlay_comp * alpha)
+                        for base_comp, overlay_comp in zip(base_rgb, overlay_rgb)
+                    )
+                    final_bubble_color = blended_rgb
+                except (ValueError, TypeError):
+                    # Fallback for invalid color strings (e.g., empty string for 'interesting')
+                    print(
+                        f"Warning: Could not parse color for {m.classification}. Using base color."
+                    )
+                    # final_bubble_color remains base_bubble_hex as set by default
+                    pass
+
+            x1, y1 = x0 + bw, y + bh
+            bubble_draw = ImageDraw.Draw(bubble_layer)
+
+            # if m.unsent:
+            #     # ... (unsent bubble drawing logic - assuming it's correct) ...
+            #     if m.side == "left":
+            #         center_big = (x0 + 5 * scale, y1 - 5 * scale)
+            #         big_rad = 7 * scale
+            #         bbox_big = (
+            #             center_big[0] - big_rad,
+            #             center_big[1] - big_rad,
+            #             center_big[0] + big_rad,
+            #             center_big[1] + big_rad,
+            #         )
+            #         bubble_draw.ellipse(bbox_big, fill=bubble_color)
+
+            #         center_small = (x0 - 3 * scale, y1 + 3 * scale)
+            #         small_rad = 3 * scale
+            #         bbox_small = (
+            #             center_small[0] - small_rad,
+            #             center_small[1] - small_rad,
+            #             center_small[0] + small_rad,
+            #             center_small[1] + small_rad,
+            #         )
+            #         bubble_draw.ellipse(bbox_small, fill=bubble_color)
+            #     else:
+            #         center_big = (x1 - 5 * scale, y1 - 5 * scale)
+            #         big_rad = 7 * scale
+            #         bbox_big = (
+            #             center_big[0] - big_rad,
+            #             center_big[1] - big_rad,
+            #             center_big[0] + big_rad,
+            #             center_big[1] + big_rad,
+            #         )
+            #         bubble_draw.ellipse(bbox_big, fill=bubble_color)
+
+            #         center_small = (x1 + 3 * scale, y1 + 3 * scale)
+            #         small_rad = 3 * scale
+            #         bbox_small = (
+            #             center_small[0] - small_rad,
+            #             center_small[1] - small_rad,
+            #             center_small[0] + small_rad,
+            #             center_small[1] + small_rad,
+            #         )
+            #         bubble_draw.ellipse(bbox_small, fill=bubble_color)
+            # else:
+
+            # Drawing logic, using final_bubble_color
+            tail = []
+            if i == len(messages) - 1 or messages[i + 1].side != m.side:
+                if m.side == "left":
+                    tail = [
+                        (x0 + 2 * scale, y + bh - 16 * scale),
+                        (x0 - 6 * scale, y + bh),
+                        (x0 + 10 * scale, y + bh - 4 * scale),
+                    ]
+                else:
+                    tail = [
+                        (x1 - 2 * scale, y + bh - 16 * scale),
+                        (x1 + 6 * scale, y + bh),
+                        (x1 - 10 * scale, y + bh - 4 * scale),
+                    ]
+            if USE_SDF:
+                # Antialiased at output resolution, with the tail's coverage
+                # joined to the bubble's so their seam doesn't show.
+                shapes.draw_bubble(
+                    bubble_layer, (x0, y, x1, y1), radius, final_bubble_color, tail
                 )
-                # final_bubble_color remains base_bubble_hex as set by default
-                pass
-
-        x1, y1 = x0 + bw, y + bh
-        bubble_draw = ImageDraw.Draw(bubble_layer)
-
-        # if m.unsent:
-        #     # ... (unsent bubble drawing logic - assuming it's correct) ...
-        #     if m.side == "left":
-        #         center_big = (x0 + 5 * scale, y1 - 5 * scale)
-        #         big_rad = 7 * scale
-        #         bbox_big = (
-        #             center_big[0] - big_rad,
-        #             center_big[1] - big_rad,
-        #             center_big[0] + big_rad,
-        #             center_big[1] + big_rad,
-        #         )
-        #         bubble_draw.ellipse(bbox_big, fill=bubble_color)
-
-        #         center_small = (x0 - 3 * scale, y1 + 3 * scale)
-        #         small_rad = 3 * scale
-        #         bbox_small = (
-        #             center_small[0] - small_rad,
-        #             center_small[1] - small_rad,
-        #             center_small[0] + small_rad,
-        #             center_small[1] + small_rad,
-        #         )
-        #         bubble_draw.ellipse(bbox_small, fill=bubble_color)
-        #     else:
-        #         center_big = (x1 - 5 * scale, y1 - 5 * scale)
-        #         big_rad = 7 * scale
-        #         bbox_big = (
-        #             center_big[0] - big_rad,
-        #             center_big[1] - big_rad,
-        #             center_big[0] + big_rad,
-        #             center_big[1] + big_rad,
-        #         )
-        #         bubble_draw.ellipse(bbox_big, fill=bubble_color)
-
-        #         center_small = (x1 + 3 * scale, y1 + 3 * scale)
-        #         small_rad = 3 * scale
-        #         bbox_small = (
-        #             center_small[0] - small_rad,
-        #             center_small[1] - small_rad,
-        #             center_small[0] + small_rad,
-        #             center_small[1] + small_rad,
-        #         )
-        #         bubble_draw.ellipse(bbox_small, fill=bubble_color)
-        # else:
-
-        # Drawing logic, using final_bubble_color
-        if i == len(messages) - 1 or messages[i + 1].side != m.side:
-            if m.side == "left":
-                tail = [
-                    (x0 + 2 * scale, y + bh - 16 * scale),
-                    (x0 - 6 * scale, y + bh),
-                    (x0 + 10 * scale, y + bh - 4 * scale),
-                ]
-                bubble_draw.polygon(tail, fill=final_bubble_color)
             else:
-                tail = [
-                    (x1 - 2 * scale, y + bh - 16 * scale),
-                    (x1 + 6 * scale, y + bh),
-                    (x1 - 10 * scale, y + bh - 4 * scale),
-                ]
-                bubble_draw.polygon(tail, fill=final_bubble_color)
-        bubble_draw.rounded_rectangle((x0, y, x1, y1), radius, fill=final_bubble_color)
-
-        text_drawings.append(
-            (
-                (x0 + pad, y + pad - text_offset),
-                txt,
-                font,
-                text_hex,
-                line_sp,
-                -10 if m.side == "left" else 10,
+                if tail:
+                    bubble_draw.polygon(tail, fill=final_bubble_color)
+                bubble_draw.rounded_rectangle(
+                    (x0, y, x1, y1), radius, fill=final_bubble_color
+                )
+
+            text_drawings.append(
+                (
+                    (x0 + pad, y + pad - text_offset),
+                    txt,
+                    font,
+                    text_hex,
+                    line_sp,
+                    -10 if m.side == "left" else 10,
+                    (x0, y, x1, y1),
+                    ImageColor.getcolor(final_bubble_color, "RGBA")
+                    if isinstance(final_bubble_color, str)
+                    else (*final_bubble_color, 255),
+                )
             )
-        )
 
-        badge_path = m.classification.png_path(
-            "white" if m.side == "right" else "black"
-        )
-        try:
-            badge = Image.open(badge_path).resize((badge_sz, badge_sz))
-            if badge.mode != "RGBA":
-                badge = badge.convert("RGBA")
-            by = y + (bh - badge_sz) // 2
-            img_bg.paste(badge, (badge_x, by), badge)
-        except FileNotFoundError:
-            print(f"Warning: Badge file not found at {badge_path}. Skipping badge.")
-
-        spacing = (
-            pad // 5
-            if (i < len(messages) - 1 and messages[i + 1].side == m.side)
-            else int(pad * 0.67)
-        )
-        y += bh + spacing
-
-    composite_img = Image.alpha_composite(img_bg, bubble_layer)
-    with Pilmoji(composite_img, source=AppleEmojiSource) as pilmoji:
-        for pos, t, f, col, sp, offs in text_drawings:
-            pilmoji.text(
-                pos,
-                t,
-                font=f,
-                fill=col,
-                spacing=sp,
-                emoji_scale_factor=1.3,
-                emoji_position_offset=(offs, 0),
+            badge_path = m.classification.png_path(
+                "white" if m.side == "right" else "black"
             )
+            try:
+                badge = load_badge(badge_path, badge_sz)
+                by = y + (bh - badge_sz) // 2
+                img_bg.paste(badge, (badge_x, by), badge)
+            except FileNotFoundError:
+                print(
+                    f"Warning: Badge file not found at {badge_path}. Skipping badge."
+                )
+
+        composite_img = Image.alpha_composite(img_bg, bubble_layer)
+        with Pilmoji(composite_img, source=CachedAppleEmojiSource) as pilmoji:
+            for pos, t, f, col, sp, offs, bubble, bubble_rgba in text_drawings:
+                draw_bubble_text(
+                    pilmoji,
+                    bubble,
+                    radius,
+                    bubble_rgba,
+                    pos,
+                    t,
+                    font=f,
+                    fill=col,
+                    spacing=sp,
+                    emoji_scale_factor=1.3,
+                    emoji_position_offset=(offs, 0),
+                )
+        return composite_img
+
+    bands = split_bands(tops, total_h, workers)
+    composite_img = stitch_bands(
+        bands, render_bands(bands, draw_band, workers), (img_w, total_h), "RGBA"
+    )
 
     final_img = composite_img.convert("RGB")
-    final_img.save(output_path)
+    return save_outputs(final_img, output_path, sizes)
 
 
 def render_reddit_chain(
@@ -428,13 +1558,18 @@ def render_reddit_chain(
     bg_color: str = "#101214",
     username_color: str = "#8FA1AB",
     text_color: str = "#D4D7D9",
-):
+    workers: int = 1,
+    avatars: dict = None,
+    deadline: float = None,
+    max_height: int = None,
+    sizes=("full",),
+) -> dict:
     SIDE_MARGIN = 45
     TOP_MARGIN = 45
     BETWEEN_MESSAGES_VERTICAL_SPACING = 40
     BOTTOM_IMAGE_PADDING = BETWEEN_MESSAGES_VERTICAL_SPACING
 
-    AVATAR_SIZE = 136
+    AVATAR_SIZE = CHAIN_AVATAR_SIZE
 
     USERNAME_AVATAR_HORIZONTAL_GAP = 30
     AVATAR_TEXT_BLOCK_VERTICAL_SPACING = 50
@@ -445,8 +1580,8 @@ def render_reddit_chain(
     TEXT_BADGE_HORIZONTAL_GAP = 30
 
     try:
-        font_username = ImageFont.truetype("fonts/Inter Bold.ttf", 56)
-        font_text = ImageFont.truetype("fonts/Inter.ttf", 64)
+        font_username = load_font("fonts/Inter Bold.ttf", 56)
+        font_text = load_font("fonts/Inter.ttf", 64)
     except IOError:
         print("Warning: Inter fonts not found. Using default.")
         font_username = ImageFont.load_default()
@@ -458,20 +1593,25 @@ def render_reddit_chain(
     def measure(text_to_measure, font_to_use):
         if not text_to_measure:
             return (0, 0)
-        bbox = measurer.textbbox((0, 0), text_to_measure, font=font_to_use, anchor="lt")
+        bbox = text_bbox(measurer, text_to_measure, font_to_use, anchor="lt")
         return bbox[2] - bbox[0], bbox[3] - bbox[1]
 
     TEXT_LINE_BBOX_HEIGHT = measure("Tg", font_text)[1]
 
+    # Avatar lookups and downloads run on the I/O pool while layout proceeds.
+    if avatars is None:
+        avatars = prefetch_avatars(msg.username for msg in messages)
+
     if not messages:
         final_height = TOP_MARGIN + BOTTOM_IMAGE_PADDING
         canvas = Image.new("RGB", (max_image_width, final_height), bg_color)
-        canvas.save(output_path)
+        paths = save_outputs(canvas, output_path, sizes)
         print("No messages to render. Saved empty image.")
-        return
+        return paths
 
     message_layouts = []
     for msg in messages:
+        check_deadline(deadline)
         max_text_width = (
             max_image_width
             - SIDE_MARGIN
@@ -589,90 +1729,140 @@ def render_reddit_chain(
         + BOTTOM_IMAGE_PADDING
     )
     final_image_height = max(final_image_height, min_height_calc)
+    check_height(final_image_height, max_height)
 
-    canvas = Image.new("RGB", (max_image_width, int(final_image_height)), bg_color)
-    draw = ImageDraw.Draw(canvas)
-
-    for idx, details in enumerate(message_draw_details):
-        msg_obj = messages[idx]
+    # Bands are cut at each message's avatar row; integer origins keep the
+    # per-band int() rounding identical to drawing on one canvas.
+    tops = [int(details["avatar_pos"][1]) for details in message_draw_details]
+    canvas_size = (max_image_width, int(final_image_height))
 
-        try:
-            icon_url = reddit.redditor(msg_obj.username).icon_img
-            response = requests.get(icon_url)
-            response.raise_for_status()
-            avatar_source_img = Image.open(io.BytesIO(response.content)).convert("RGBA")
-        except:
-            avatar_source_img = Image.new("RGBA", (AVATAR_SIZE, AVATAR_SIZE), "#888")
-
-        hires_avatar_size = AVATAR_SIZE * 4
-        hires_avatar = avatar_source_img.resize(
-            (hires_avatar_size, hires_avatar_size), Image.LANCZOS
-        )
-        avatar_bg_hires = Image.new(
-            "RGBA", (hires_avatar_size, hires_avatar_size), bg_color
-        )
-        avatar_bg_hires.paste(hires_avatar, (0, 0), hires_avatar)
-        mask_hires = Image.new("L", (hires_avatar_size, hires_avatar_size), 0)
-        ImageDraw.Draw(mask_hires).ellipse(
-            (0, 0, hires_avatar_size, hires_avatar_size), fill=255
-        )
-        final_avatar = avatar_bg_hires.resize((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
-        final_mask = mask_hires.resize((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
-        canvas.paste(
-            final_avatar,
-            (int(details["avatar_pos"][0]), int(details["avatar_pos"][1])),
-            final_mask,
+    def draw_band(start, end, band_top, band_bottom):
+        canvas = Image.new(
+            "RGB", (max_image_width, band_bottom - band_top), bg_color
         )
+        draw = ImageDraw.Draw(canvas)
+
+        for idx in range(start, end):
+            check_deadline(deadline)
+            details = message_draw_details[idx]
+            msg_obj = messages[idx]
+
+            draw_text_line(
+                canvas,
+                draw,
+                (
+                    int(details["username_pos"][0]),
+                    int(details["username_pos"][1]) - band_top,
+                ),
+                msg_obj.username,
+                font_username,
+                username_color,
+            )
 
-        draw.text(
-            (int(details["username_pos"][0]), int(details["username_pos"][1])),
-            msg_obj.username,
-            font=font_username,
-            fill=username_color,
-            anchor="lt",
-        )
+            current_text_y = details["text_block_start_pos"][1]
+            for line_text in details["text_lines"]:
+                draw_text_line(
+                    canvas,
+                    draw,
+                    (
+                        int(details["text_block_start_pos"][0]),
+                        int(current_text_y) - band_top,
+                    ),
+                    line_text,
+                    font_text,
+                    text_color,
+                )
+                current_text_y += TEXT_LINE_BBOX_HEIGHT + TEXT_LINE_LEADING
 
-        current_text_y = details["text_block_start_pos"][1]
-        for line_text in details["text_lines"]:
-            draw.text(
-                (int(details["text_block_start_pos"][0]), int(current_text_y)),
-                line_text,
-                font=font_text,
-                fill=text_color,
-                anchor="lt",
-            )
-            current_text_y += TEXT_LINE_BBOX_HEIGHT + TEXT_LINE_LEADING
+            if details["badge_exists"] and details["badge_path"]:
+                try:
+                    badge_img_resized = load_badge(
+                        details["badge_path"], BADGE_SIZE, Image.LANCZOS
+                    )
+                    canvas.paste(
+                        badge_img_resized,
+                        (
+                            int(details["badge_pos"][0]),
+                            int(details["badge_pos"][1]) - band_top,
+                        ),
+                        badge_img_resized,
+                    )
+                except FileNotFoundError:
+                    print(f"Badge file not found: {details['badge_path']}")
+                except IOError:
+                    print(f"Could not open badge: {details['badge_path']}")
+
+        # Avatars go last so text and badges are drawn while downloads are
+        # still in flight; they never overlap, so the order doesn't matter.
+        for idx in range(start, end):
+            check_deadline(deadline)
+            details = message_draw_details[idx]
+            msg_obj = messages[idx]
+
+            avatar_source_img = avatars[msg_obj.username].result()
+            if avatar_source_img is None:
+                avatar_source_img = Image.new(
+                    "RGBA", (AVATAR_SIZE, AVATAR_SIZE), "#888"
+                )
 
-        if details["badge_exists"] and details["badge_path"]:
-            try:
-                badge_img = Image.open(details["badge_path"]).convert("RGBA")
-                badge_img_resized = badge_img.resize(
-                    (BADGE_SIZE, BADGE_SIZE), Image.LANCZOS
+            if USE_SDF:
+                # The mask is antialiased on its own, so the avatar goes
+                # straight to its final size.
+                avatar = avatar_source_img.resize(
+                    (AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS
                 )
-                canvas.paste(
-                    badge_img_resized,
-                    (int(details["badge_pos"][0]), int(details["badge_pos"][1])),
-                    badge_img_resized,
+                final_avatar = Image.new("RGBA", avatar.size, bg_color)
+                final_avatar.paste(avatar, (0, 0), avatar)
+            else:
+                hires_avatar_size = AVATAR_SIZE * 4
+                hires_avatar = avatar_source_img.resize(
+                    (hires_avatar_size, hires_avatar_size), Image.LANCZOS
                 )
-            except FileNotFoundError:
-                print(f"Badge file not found: {details['badge_path']}")
-            except IOError:
-                print(f"Could not open badge: {details['badge_path']}")
+                avatar_bg_hires = Image.new(
+                    "RGBA", (hires_avatar_size, hires_avatar_size), bg_color
+                )
+                avatar_bg_hires.paste(hires_avatar, (0, 0), hires_avatar)
+                final_avatar = avatar_bg_hires.resize(
+                    (AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS
+                )
+            canvas.paste(
+                final_avatar,
+                (
+                    int(details["avatar_pos"][0]),
+                    int(details["avatar_pos"][1]) - band_top,
+                ),
+                avatar_mask(AVATAR_SIZE),
+            )
+        return canvas
 
-    canvas.save(output_path)
+    bands = split_bands(tops, canvas_size[1], workers)
+    canvas = stitch_bands(
+        bands, render_bands(bands, draw_band, workers), canvas_size, "RGB"
+    )
+
+    paths = save_outputs(canvas, output_path, sizes)
     print(f"Reddit chain image saved to {output_path}")
+    return paths
+
+
+UPLOAD_API_URL = os.environ.get(
+    "UPLOAD_API_URL", "https://allthepics.net/api/1/upload"
+)
+
+if USE_CLOUDSCRAPER:
+    # Use cloudscraper if available to bypass Cloudflare
+    http.register(UPLOAD_API_URL, cloudscraper.create_scraper)
 
 
 def upload_with_api(api_key, file_path, title=None, expiration=None):
     """
     Uploads an image to allthepics.net using their official V1 API.
-    Retries up to 3 times if a network or API error occurs.
+    Network errors and 5xx/429 responses are retried by the shared transport.
     """
     if not os.path.exists(file_path):
         print(f"Error: File not found at '{file_path}'")
         return None
 
-    api_url = "https://allthepics.net/api/1/upload"
     headers = {
         "X-API-Key": api_key,
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
@@ -684,60 +1874,251 @@ def upload_with_api(api_key, file_path, title=None, expiration=None):
     if expiration:
         data["expiration"] = expiration
 
-    # Use cloudscraper if available to bypass Cloudflare
-    session = cloudscraper.create_scraper() if USE_CLOUDSCRAPER else requests.Session()
+    # The body streams straight out of a memory map of the file.
+    image = SpooledFile(file_path)
+    body = MultipartStream(
+        data, {"source": (os.path.basename(file_path), image.view, "image/png")}
+    )
+    headers["Content-Type"] = body.content_type
 
-    max_retries = 3
-    for attempt in range(1, max_retries + 1):
-        try:
-            with open(file_path, "rb") as f:
-                files = {"source": f}
-                print(
-                    f"Uploading '{os.path.basename(file_path)}' to image host with title '{title}'... (Attempt {attempt})"
-                )
-                print(f"Using {'cloudscraper' if USE_CLOUDSCRAPER else 'requests'}")
-                print(f"API key length: {len(api_key)} chars, starts with: {api_key[:8]}...")
+    try:
+        print(
+            f"Uploading '{os.path.basename(file_path)}' to image host "
+            f"with title '{title}'..."
+        )
+        print(f"Using {'cloudscraper' if USE_CLOUDSCRAPER else 'requests'}")
+        print(f"API key length: {len(api_key)} chars, starts with: {api_key[:8]}...")
 
-                response = session.post(
-                    api_url, headers=headers, data=data, files=files
-                )
+        response = http.post(UPLOAD_API_URL, headers=headers, data=body)
 
-                # Print response details before raising
-                print(f"Response status: {response.status_code}")
-                if response.status_code != 200:
-                    print(f"Response body: {response.text}")
-
-                response.raise_for_status()
-                json_response = response.json()
-
-                if json_response.get("status_code") == 200:
-                    print("Upload successful!")
-                    image_info = json_response.get("image", {})
-                    return {
-                        "image_url": image_info.get("url"),
-                        "delete_url": image_info.get("delete_url"),
-                    }
-                else:
-                    error_message = json_response.get("error", {}).get(
-                        "message", "Unknown API error"
-                    )
-                    print(f"API Error: {error_message}")
-                    return None
-        except requests.exceptions.RequestException as e:
-            print(f"A network or API error occurred: {e}")
-            if attempt < max_retries:
-                print(
-                    f"Retrying in 2 seconds... (Attempt {attempt + 1} of {max_retries})"
+        # Print response details before raising
+        print(f"Response status: {response.status_code}")
+        if response.status_code != 200:
+            print(f"Response body: {response.text}")
+
+        response.raise_for_status()
+        json_response = response.json()
+    except requests.exceptions.RequestException as e:
+        print(f"A network or API error occurred: {e}")
+        return None
+    finally:
+        body.close()
+        image.close()
+
+    if json_response.get("status_code") == 200:
+        print("Upload successful!")
+        image_info = json_response.get("image", {})
+        return {
+            "image_url": image_info.get("url"),
+            "delete_url": image_info.get("delete_url"),
+        }
+    else:
+        error_message = json_response.get("error", {}).get(
+            "message", "Unknown API error"
+        )
+        print(f"API Error: {error_message}")
+        return None
+
+
+class JsonStream:
+    """
+    Incremental reader for one JSON document on a text stream. Arrays and
+    objects can be walked one member at a time, so only the member currently
+    being decoded is buffered rather than the whole payload text.
+    """
+
+    def __init__(self, fp, chunk_size=1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # Read at least as much as is already pending so a member spanning
+        # many chunks is re-scanned a logarithmic number of times.
+        chunk = self.fp.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        return True
+
+    def _peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buf, self.pos)
+        self.pos += 1
+
+    def _separator(self, closing):
+        """Consumes ',' or the closing bracket; returns True once closed."""
+        char = self._peek()
+        self.pos += 1
+        if char == closing:
+            return True
+        if char != ",":
+            raise json.JSONDecodeError(
+                "Expecting ',' delimiter", self.buf, self.pos - 1
+            )
+        return False
+
+    def value(self):
+        """Decodes the next complete JSON value."""
+        self._peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # A number ending exactly at the buffer edge may continue in the
+            # next chunk.
+            if end == len(self.buf) and self._fill():
+                continue
+            self.pos = end
+            return value
+
+    def iter_array(self):
+        """Yields the elements of the array at the cursor."""
+        self._expect("[")
+        if self._peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self._separator("]"):
+                return
+
+    def iter_object(self):
+        """
+        Yields the keys of the object at the cursor. The caller must consume
+        each key's value (value() or iter_array()) before asking for the next.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            if self._peek() != '"':
+                raise json.JSONDecodeError(
+                    "Expecting property name enclosed in double quotes",
+                    self.buf,
+                    self.pos,
                 )
-                time.sleep(2)
+            key = self.value()
+            self._expect(":")
+            yield key
+            if self._separator("}"):
+                return
+
+    def finish(self):
+        if self._peek():
+            raise json.JSONDecodeError("Extra data", self.buf, self.pos)
+
+
+def parse_message(command, msg_data):
+    """
+    Converts one payload message into a TextMessage (render_and_upload) or a
+    RedditComment (render_and_upload_reddit_chain). Invalid messages are
+    reported and skipped by returning None.
+    """
+    try:
+        classification_str = msg_data.get("classification")
+        if not classification_str:
+            print(
+                f"Warning: Message data missing classification: {msg_data}. Skipping message."
+            )
+            return None
+        classification_enum = Classification(classification_str.lower())
+
+        if command == "render_and_upload":
+            return TextMessage(
+                side=msg_data["side"],
+                content=msg_data["content"],
+                classification=classification_enum,
+            )
+        return RedditComment(
+            username=msg_data["username"],
+            content=msg_data["content"],
+            classification=classification_enum,
+        )
+    except ValueError:
+        print(
+            f"Warning: Unknown classification '{msg_data.get('classification')}' received. Skipping message."
+        )
+    except KeyError as ke:
+        print(f"Warning: Message data missing key {ke}: {msg_data}. Skipping message.")
+    return None
+
+
+def parse_payload(command, payload):
+    """Splits an already-decoded payload into (messages, color block)."""
+    if command == "render_and_upload":
+        messages, color_block = payload.get("messages", []), payload.get("color", {})
+    else:
+        messages, color_block = payload, {}
+    parsed_messages = [parse_message(command, msg_data) for msg_data in messages]
+    return [m for m in parsed_messages if m], color_block
+
+
+def stream_payload(command, fp):
+    """
+    Same result as parse_payload(command, json.load(fp)), but messages are
+    decoded and converted one at a time as the stream is read.
+    """
+    reader = JsonStream(fp)
+    parsed_messages, color_block = [], {}
+
+    def add_messages(items):
+        for msg_data in items:
+            msg_obj = parse_message(command, msg_data)
+            if msg_obj:
+                parsed_messages.append(msg_obj)
+
+    if command == "render_and_upload":
+        for key in reader.iter_object():
+            if key == "messages":
+                add_messages(reader.iter_array())
+            elif key == "color":
+                color_block = reader.value()
             else:
-                print("Max retries reached. Giving up.")
-                return None
+                reader.value()
+    else:
+        add_messages(reader.iter_array())
+    reader.finish()
+    return parsed_messages, color_block
 
 
-# --- CLI Main Function ---
-def main():
-    _, command, uid = sys.argv
+def load_payload(command, payload_path=None):
+    """
+    Reads the payload from `payload_path` ("-" for stdin) when given, and
+    from the RENDER_PAYLOAD_JSON environment variable otherwise. Exits on
+    missing or malformed input.
+    """
+    if payload_path:
+        source = "stdin" if payload_path == "-" else payload_path
+        try:
+            if payload_path == "-":
+                return stream_payload(command, sys.stdin)
+            with open(payload_path, encoding="utf-8") as f:
+                return stream_payload(command, f)
+        except OSError as e:
+            print(f"Error reading payload from {source}: {e}")
+            sys.exit(1)
+        except json.JSONDecodeError as e:
+            print(f"Error parsing JSON payload from {source}: {e}")
+            sys.exit(1)
 
     payload_json_string = os.environ.get("RENDER_PAYLOAD_JSON")
     if not payload_json_string:
@@ -752,171 +2133,255 @@ def main():
             f"Received string: {payload_json_string[:500]}..."
         )  # Print first 500 chars for debugging
         sys.exit(1)
+    return parse_payload(command, payload)
 
-    local_output_path = f"{uid}.png"
-
-    print(f"Executing command: {command} for replying to: {uid}")
 
+async def render_job(
+    command,
+    parsed_messages,
+    color_block,
+    output_path,
+    *,
+    workers=1,
+    limits=None,
+    timings=None,
+    sizes=("full",),
+):
+    """
+    Renders one job to `output_path`, plus a smaller copy next to it for
+    every other name in `sizes` (see save_outputs), and returns {name: path}.
+    Network-bound work (avatar lookups and downloads, emoji prefetch) starts
+    as soon as the payload is parsed and runs on the I/O pool, while layout
+    and drawing run in the default executor.
+
+    The job first goes through admission control against `limits` (from the
+    environment by default): it may be rejected (ValueError), truncated, or
+    downgraded to a cheaper mode, and rendering must finish within the
+    limits' deadline (TimeoutError) on a canvas no taller than
+    limits.max_canvas_height (ValueError). A downgraded conversation comes
+    back as a smaller image, 640 px wide rather than 1280; a downgraded
+    chain keeps its size but every avatar is the placeholder.
+
+    If a `timings` dict is given, the render seconds are stored in it.
+    """
+    timings = {} if timings is None else timings
+    limits = limits or RenderLimits.from_env()
+    admission = admit(parsed_messages, limits)
+    print(f"Admission: {admission.action} ({admission.reason})")
+    if admission.action == "reject":
+        raise ValueError(f"Job rejected: {admission.reason}")
+    parsed_messages = admission.messages
+    cheap = admission.action == "downgrade"
+
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    deadline = time.monotonic() + limits.deadline_seconds
+
+    print(f"Rendering image to temporary file: {output_path}")
     if command == "render_and_upload":
-        print(f"Rendering image to temporary file: {local_output_path}")
-
-        parsed_messages = []
-        for msg_data in payload.get("messages", []):
-            try:
-                classification_str = msg_data.get("classification")
-                if not classification_str:
-                    print(
-                        f"Warning: Message data missing classification: {msg_data}. Skipping message."
-                    )
-                    continue
-                classification_enum = Classification(classification_str.lower())
-                parsed_messages.append(
-                    TextMessage(
-                        side=msg_data["side"],
-                        content=msg_data["content"],
-                        classification=classification_enum,
-                    )
-                )
-            except ValueError:
-                print(
-                    f"Warning: Unknown classification '{msg_data.get('classification')}' received. Skipping message."
-                )
-                continue
-            except KeyError as ke:
-                print(
-                    f"Warning: Message data missing key {ke}: {msg_data}. Skipping message."
-                )
-                continue
-
-        color_block = payload.get("color", {})
-        color_data_left = color_block.get("left")
-        color_data_right = color_block.get("right")
-        background_hex = color_block.get("background_hex")
-
-        render_conversation(
+        prefetch_emoji(m.content for m in parsed_messages)
+        render = functools.partial(
+            render_conversation,
+            parsed_messages,
+            color_block.get("left"),
+            color_block.get("right"),
+            color_block.get("background_hex"),
+            output_path,
+            workers=workers,
+            # scale is the output size: 640 px wide instead of 1280, a
+            # quarter of the pixels to draw and encode.
+            scale=2 if cheap else 4,
+            deadline=deadline,
+            max_height=limits.max_canvas_height,
+            sizes=sizes,
+        )
+    else:
+        if cheap:
+            # Skip avatar lookups and downloads; everyone gets the placeholder.
+            no_avatar = Future()
+            no_avatar.set_result(None)
+            avatars = {m.username: no_avatar for m in parsed_messages}
+        else:
+            avatars = prefetch_avatars(m.username for m in parsed_messages)
+        render = functools.partial(
+            render_reddit_chain,
             parsed_messages,
-            color_data_left,
-            color_data_right,
-            background_hex,
-            local_output_path,
+            output_path,
+            workers=workers,
+            avatars=avatars,
+            deadline=deadline,
+            max_height=limits.max_canvas_height,
+            sizes=sizes,
         )
-        print("Image rendered successfully.")
+    paths = await loop.run_in_executor(None, render)
+    timings["render"] = time.perf_counter() - started
+    print(f"Image rendered successfully in {timings['render']:.2f}s.")
+    return paths
+
+
+async def run_job(
+    command,
+    uid,
+    parsed_messages,
+    color_block,
+    api_key,
+    output_path,
+    *,
+    workers=1,
+    limits=None,
+    timings=None,
+    sizes=("full",),
+):
+    """
+    Renders (see render_job) and uploads one job. The upload connection is
+    opened while the image renders, so the job takes roughly max(network,
+    CPU) instead of their sum. Returns upload_with_api's result for the
+    largest size.
 
-        try:
-            api_key = os.environ.get("ALLTHEPICS_API_KEY")
-            if not api_key:
-                print("Error: ALLTHEPICS_API_KEY environment variable not set.")
-                if os.path.exists(local_output_path):
-                    os.remove(local_output_path)
-                sys.exit(1)
-
-            upload_result = upload_with_api(
-                api_key, local_output_path, title=uid, expiration="PT5M"
-            )
+    With more than one of `sizes`, every size is uploaded concurrently, the
+    largest titled `uid` and the others `uid-<size>`, and the result gains a
+    "sizes" entry mapping each size to its image URL (None if it failed).
 
-            if not upload_result or not upload_result.get("image_url"):
-                print("Failed to upload image to host. Aborting.")
-                if os.path.exists(local_output_path):
-                    os.remove(local_output_path)
-                sys.exit(1)
+    If a `timings` dict is given, the render, upload and total seconds are
+    stored in it.
+    """
+    timings = {} if timings is None else timings
+    loop = asyncio.get_running_loop()
+    started = time.perf_counter()
+    preconnect = loop.run_in_executor(io_pool, http.preconnect, UPLOAD_API_URL)
+    paths = await render_job(
+        command,
+        parsed_messages,
+        color_block,
+        output_path,
+        workers=workers,
+        limits=limits,
+        timings=timings,
+        sizes=sizes,
+    )
 
-            image_url = upload_result["image_url"]
-            print(f"Image available at: {image_url}")
-        except Exception as e:
-            print(f"An error occurred during uploading: {e}")
-            import traceback
+    await preconnect
+    uploads = [
+        loop.run_in_executor(
+            io_pool,
+            functools.partial(
+                upload_with_api,
+                api_key,
+                path,
+                title=uid if i == 0 else f"{uid}-{name}",
+                expiration="PT5M",
+            ),
+        )
+        for i, (name, path) in enumerate(paths.items())
+    ]
+    results = dict(zip(paths, await asyncio.gather(*uploads)))
+    upload_result = next(iter(results.values()))
+    if upload_result and len(results) > 1:
+        upload_result = {
+            **upload_result,
+            "sizes": {
+                name: result and result.get("image_url")
+                for name, result in results.items()
+            },
+        }
+    timings["total"] = time.perf_counter() - started
+    timings["upload"] = timings["total"] - timings["render"]
+    print(f"Job finished in {timings['total']:.2f}s.")
+    http.metrics.report()
+    text_cache.report()
+    return upload_result
 
-            traceback.print_exc()
-            if os.path.exists(local_output_path):
-                os.remove(local_output_path)
-            sys.exit(1)
-        finally:
-            if os.path.exists(local_output_path):
-                try:
-                    os.remove(local_output_path)
-                    print(f"Cleaned up temporary file: {local_output_path}")
-                except Exception as e_remove:
-                    print(
-                        f"Error cleaning up temporary file {local_output_path}: {e_remove}"
-                    )
-    elif command == "render_and_upload_reddit_chain":
-        print(f"Rendering image to temporary file: {local_output_path}")
 
-        parsed_messages = []
-        for msg_data in payload:
-            try:
-                classification_str = msg_data.get("classification")
-                if not classification_str:
-                    print(
-                        f"Warning: Message data missing classification: {msg_data}. Skipping message."
-                    )
-                    continue
-                classification_enum = Classification(classification_str.lower())
+# --- CLI Main Function ---
+def main():
+    # Usage: renderer.py [--profile[=DIR]] <command> <uid> [payload.json | -]
+    #        renderer.py warm [username ...]
+    # --profile (or RENDER_PROFILE=DIR) samples the job and writes a
+    # flamegraph-ready <uid>.collapsed and a <uid>-summary.txt to DIR.
+    profile_dir = os.environ.get("RENDER_PROFILE")
+    args = []
+    for arg in sys.argv[1:]:
+        if arg == "--profile" or arg.startswith("--profile="):
+            profile_dir = arg.partition("=")[2] or "profile"
+        else:
+            args.append(arg)
+    if args[:1] == ["warm"]:
+        write_snapshot(usernames=args[1:])
+        return
+    command, uid, *payload_path = args
 
-                parsed_messages.append(
-                    RedditComment(
-                        username=msg_data["username"],
-                        content=msg_data["content"],
-                        classification=classification_enum,
-                    )
-                )
-            except ValueError:
-                print(
-                    f"Warning: Unknown classification '{msg_data.get('classification')}' received. Skipping message."
-                )
-                continue
-            except KeyError as ke:
-                print(
-                    f"Warning: Message data missing key {ke}: {msg_data}. Skipping message."
-                )
-                continue
+    if command not in ("render_and_upload", "render_and_upload_reddit_chain"):
+        print(f"Unknown command: {command}")
+        sys.exit(1)
 
-        render_reddit_chain(
-            parsed_messages,
-            local_output_path,
-        )
-        print("Image rendered successfully.")
+    load_snapshot()
+    parsed_messages, color_block = load_payload(command, *payload_path)
+
+    local_output_path = spool_path(f"{uid}.png")
+
+    # Horizontal bands drawn in parallel; 1 keeps the single-threaded path.
+    workers = int(os.environ.get("RENDER_WORKERS", "1"))
+    # e.g. "full,half,thumb": extra sizes are reduced from the same render.
+    sizes = [
+        name.strip()
+        for name in (os.environ.get("RENDER_SIZES") or "full").split(",")
+        if name.strip()
+    ]
+    unknown = [name for name in sizes if name not in OUTPUT_SIZES]
+    if unknown:
+        print(f"Unknown RENDER_SIZES: {', '.join(unknown)}")
+        sys.exit(1)
 
-        try:
-            api_key = os.environ.get("ALLTHEPICS_API_KEY")
-            if not api_key:
-                print("Error: ALLTHEPICS_API_KEY environment variable not set.")
-                if os.path.exists(local_output_path):
-                    os.remove(local_output_path)
-                sys.exit(1)
-
-            upload_result = upload_with_api(
-                api_key, local_output_path, title=uid, expiration="PT5M"
-            )
+    print(f"Executing command: {command} for replying to: {uid}")
 
-            if not upload_result or not upload_result.get("image_url"):
-                print("Failed to upload image to host. Aborting.")
-                if os.path.exists(local_output_path):
-                    os.remove(local_output_path)
-                sys.exit(1)
+    api_key = os.environ.get("ALLTHEPICS_API_KEY")
+    if not api_key:
+        print("Error: ALLTHEPICS_API_KEY environment variable not set.")
+        sys.exit(1)
 
-            image_url = upload_result["image_url"]
-            print(f"Image available at: {image_url}")
-        except Exception as e:
-            print(f"An error occurred during uploading: {e}")
-            import traceback
+    job = run_job(
+        command,
+        uid,
+        parsed_messages,
+        color_block,
+        api_key,
+        local_output_path,
+        workers=workers,
+        sizes=sizes,
+    )
+    try:
+        if profile_dir:
+            interval = float(os.environ.get("RENDER_PROFILE_INTERVAL", "0.005"))
+            sampler = Sampler(interval)
+            try:
+                with sampler:
+                    upload_result = asyncio.run(job)
+            finally:
+                print(sampler.write(profile_dir, uid))
+                print(f"Profile written to {profile_dir}/")
+        else:
+            upload_result = asyncio.run(job)
 
-            traceback.print_exc()
-            if os.path.exists(local_output_path):
-                os.remove(local_output_path)
+        if not upload_result or not upload_result.get("image_url"):
+            print("Failed to upload image to host. Aborting.")
             sys.exit(1)
-        finally:
-            if os.path.exists(local_output_path):
+
+        image_url = upload_result["image_url"]
+        print(f"Image available at: {image_url}")
+        for name, url in upload_result.get("sizes", {}).items():
+            print(f"  {name}: {url}")
+    except Exception as e:
+        print(f"An error occurred during rendering or uploading: {e}")
+        traceback.print_exc()
+        sys.exit(1)
+    finally:
+        for path in {output_variant(local_output_path, name) for name in sizes}:
+            if os.path.exists(path):
                 try:
-                    os.remove(local_output_path)
-                    print(f"Cleaned up temporary file: {local_output_path}")
+                    os.remove(path)
+                    print(f"Cleaned up temporary file: {path}")
                 except Exception as e_remove:
-                    print(
-                        f"Error cleaning up temporary file {local_output_path}: {e_remove}"
-                    )
-    else:
-        print(f"Unknown command: {command}")
-        sys.exit(1)
+                    print(f"Error cleaning up temporary file {path}: {e_remove}")
 
 
 if __name__ == "__main__":
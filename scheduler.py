@@ -0,0 +1,412 @@
+"""
+Local job scheduler in front of the render commands.
+
+Jobs are queued in SQLite (JOB_DB, default jobs.sqlite3), so a restart loses
+nothing. A worker holds a lease on the job it runs (JOB_LEASE seconds,
+renewed before every upload); jobs whose lease ran out, because their worker
+died, go back to the queue. Jobs other processes are still working on are
+left alone.
+
+- Identical payloads for the same command coalesce: while one is queued or
+  running, later submissions just add their uid as another waiter. The job
+  is rendered once and uploaded once per waiting uid, since each reply looks
+  for its own upload title.
+- Payloads submitted with a thread id (the post or comment chain they
+  render) supersede queued ones for the same thread: the older job is
+  dropped and its uids wait on the newer render instead.
+- The cheapest jobs run first (estimated wrapped lines, chains weighted
+  double), with queued jobs gaining priority as they wait so big ones still
+  get their turn.
+- Every job has a deadline (JOB_DEADLINE seconds after its first
+  submission, default 300). Jobs past it are dropped instead of started, and
+  a running job gets only the time left as its render deadline.
+
+Usage: python scheduler.py submit <command> <uid> [payload.json | -] [--thread ID]
+       python scheduler.py run [workers] [--forever]
+       python scheduler.py status
+"""
+
+import asyncio
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+
+os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+import renderer
+
+JOB_DB = os.environ.get("JOB_DB", "jobs.sqlite3")
+JOB_DEADLINE = float(os.environ.get("JOB_DEADLINE", "300"))
+# Longer than any render, which the deadline bounds; uploads renew it.
+JOB_LEASE = float(os.environ.get("JOB_LEASE", JOB_DEADLINE + 300))
+# How many estimated lines of priority a job gains per second of waiting.
+AGING_LINES_PER_SECOND = 10
+CHAIN_WEIGHT = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    key TEXT NOT NULL,
+    command TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    cost INTEGER NOT NULL,
+    created REAL NOT NULL,
+    deadline REAL NOT NULL,
+    state TEXT NOT NULL DEFAULT 'queued',
+    error TEXT,
+    thread TEXT,
+    owner TEXT,
+    lease REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, state);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, cost);
+CREATE TABLE IF NOT EXISTS waiters (
+    uid TEXT PRIMARY KEY,
+    job_id INTEGER NOT NULL REFERENCES jobs (id),
+    submitted REAL NOT NULL,
+    result TEXT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS waiters_job ON waiters (job_id);
+"""
+
+# Columns added to jobs since the first schema, for existing databases.
+JOB_COLUMNS = {"thread": "TEXT", "owner": "TEXT", "lease": "REAL"}
+
+
+def job_key(command, payload):
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{command}\n{canonical}".encode()).hexdigest()
+
+
+def job_cost(command, payload):
+    messages, _ = renderer.parse_payload(command, payload)
+    lines = renderer.estimate_cost(messages).lines
+    return lines * (CHAIN_WEIGHT if command == "render_and_upload_reddit_chain" else 1)
+
+
+def worker_id():
+    """Owner recorded on a claimed job: this process and thread."""
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+class Scheduler:
+    def __init__(self, path=JOB_DB, deadline=JOB_DEADLINE, lease=JOB_LEASE):
+        self.path = path
+        self.deadline = deadline
+        self.lease = lease
+        self.local = threading.local()
+        self.db.executescript(SCHEMA)
+        columns = {row["name"] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        for column, kind in JOB_COLUMNS.items():
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {kind}")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_thread ON jobs (command, thread, state)"
+        )
+
+    @property
+    def db(self):
+        # sqlite3 connections can't be shared across threads.
+        if not hasattr(self.local, "db"):
+            self.local.db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.local.db.row_factory = sqlite3.Row
+        return self.local.db
+
+    def transaction(self):
+        return Transaction(self.db)
+
+    def submit(self, command, uid, payload, now=None, thread=None) -> int:
+        """
+        Queues `payload` for `uid`, joining an identical queued or running
+        job when there is one. With a `thread`, queued jobs for the same
+        command and thread are superseded by this one. Returns the job id.
+        """
+        now = time.time() if now is None else now
+        key = job_key(command, payload)
+        with self.transaction() as db:
+            row = db.execute(
+                "SELECT id FROM jobs WHERE key = ? AND state IN ('queued', 'running')",
+                (key,),
+            ).fetchone()
+            if row:
+                job_id = row["id"]
+            else:
+                job_id = db.execute(
+                    "INSERT INTO jobs"
+                    " (key, command, payload, cost, created, deadline, thread)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        command,
+                        json.dumps(payload),
+                        job_cost(command, payload),
+                        now,
+                        now + self.deadline,
+                        thread,
+                    ),
+                ).lastrowid
+            if thread is not None:
+                self._supersede(db, command, thread, job_id)
+            db.execute(
+                "INSERT OR REPLACE INTO waiters (uid, job_id, submitted)"
+                " VALUES (?, ?, ?)",
+                (uid, job_id, now),
+            )
+        return job_id
+
+    def _supersede(self, db, command, thread, job_id):
+        # Jobs already running are left to finish; their render is only as
+        # stale as the one their waiters asked for.
+        older = [
+            row["id"]
+            for row in db.execute(
+                "SELECT id FROM jobs WHERE command = ? AND thread = ?"
+                " AND state = 'queued' AND id != ?",
+                (command, thread, job_id),
+            )
+        ]
+        for old_id in older:
+            db.execute(
+                "UPDATE waiters SET job_id = ?"
+                " WHERE job_id = ? AND result IS NULL AND error IS NULL",
+                (job_id, old_id),
+            )
+            db.execute("UPDATE jobs SET state = 'superseded' WHERE id = ?", (old_id,))
+
+    def _requeue_expired(self, db, now):
+        return db.execute(
+            "UPDATE jobs SET state = 'queued', owner = NULL, lease = NULL"
+            " WHERE state = 'running' AND (lease IS NULL OR lease <= ?)",
+            (now,),
+        ).rowcount
+
+    def recover(self, now=None):
+        """Requeues running jobs whose lease ran out: their worker died."""
+        now = time.time() if now is None else now
+        with self.transaction() as db:
+            count = self._requeue_expired(db, now)
+        if count:
+            print(f"Requeued {count} interrupted job(s).")
+
+    def claim(self, now=None):
+        """
+        Marks the highest-priority live job running under a lease owned by
+        this thread and returns its row, or None when the queue is empty.
+        Jobs whose lease ran out are requeued and expired jobs failed on the
+        way.
+        """
+        now = time.time() if now is None else now
+        with self.transaction() as db:
+            self._requeue_expired(db, now)
+            expired = [
+                row["id"]
+                for row in db.execute(
+                    "SELECT id FROM jobs WHERE state = 'queued' AND deadline <= ?",
+                    (now,),
+                )
+            ]
+            for job_id in expired:
+                self._finish(db, job_id, "expired", "deadline passed while queued")
+            claimed = db.execute(
+                "UPDATE jobs SET state = 'running', owner = ?, lease = ? WHERE id = ("
+                "  SELECT id FROM jobs WHERE state = 'queued'"
+                "  ORDER BY cost - (? - created) * ?, created LIMIT 1"
+                ") RETURNING *",
+                (worker_id(), now + self.lease, now, AGING_LINES_PER_SECOND),
+            ).fetchall()
+        return claimed[0] if claimed else None
+
+    def _finish(self, db, job_id, state, error=None):
+        db.execute(
+            "UPDATE jobs SET state = ?, error = ? WHERE id = ?", (state, error, job_id)
+        )
+        if error:
+            db.execute(
+                "UPDATE waiters SET error = ?"
+                " WHERE job_id = ? AND result IS NULL AND error IS NULL",
+                (error, job_id),
+            )
+
+    def renew(self, job):
+        """
+        Extends this worker's lease on `job`. False when it no longer holds
+        it, because the lease ran out and the job was requeued.
+        """
+        return (
+            self.db.execute(
+                "UPDATE jobs SET lease = ?"
+                " WHERE id = ? AND owner = ? AND state = 'running'",
+                (time.time() + self.lease, job["id"], job["owner"]),
+            ).rowcount
+            == 1
+        )
+
+    def pending_uids(self, job_id):
+        return [
+            row["uid"]
+            for row in self.db.execute(
+                "SELECT uid FROM waiters"
+                " WHERE job_id = ? AND result IS NULL AND error IS NULL"
+                " ORDER BY submitted",
+                (job_id,),
+            )
+        ]
+
+    def process(self, job, api_key, workers=1):
+        """Renders a claimed job once, then uploads it for every waiting uid."""
+        job_id = job["id"]
+        # Unique per claim: a worker that lost its lease may still be writing
+        # or removing its file while the job's new owner uploads from its own.
+        output_path = renderer.spool_path(f"job{job_id}-{uuid.uuid4().hex}.png")
+        remaining = job["deadline"] - time.time()
+        limits = dataclasses.replace(
+            renderer.RenderLimits.from_env(),
+            deadline_seconds=max(0.0, remaining),
+        )
+        try:
+            messages, color_block = renderer.parse_payload(
+                job["command"], json.loads(job["payload"])
+            )
+            asyncio.run(
+                renderer.render_job(
+                    job["command"],
+                    messages,
+                    color_block,
+                    output_path,
+                    workers=workers,
+                    limits=limits,
+                )
+            )
+            # Waiters can still join while earlier ones upload; only mark the
+            # job done once a final check inside the transaction finds none.
+            while True:
+                for uid in self.pending_uids(job_id):
+                    if not self.renew(job):
+                        print(f"Warning: Lost the lease on job {job_id}")
+                        return
+                    result = renderer.upload_with_api(
+                        api_key, output_path, title=uid, expiration="PT5M"
+                    )
+                    column = "result" if result else "error"
+                    self.db.execute(
+                        f"UPDATE waiters SET {column} = ? WHERE uid = ?",
+                        (json.dumps(result) if result else "upload failed", uid),
+                    )
+                with self.transaction() as db:
+                    if not self.renew(job):
+                        print(f"Warning: Lost the lease on job {job_id}")
+                        return
+                    if not self.pending_uids(job_id):
+                        self._finish(db, job_id, "done")
+                        break
+        except Exception as e:
+            with self.transaction() as db:
+                if self.renew(job):
+                    self._finish(db, job_id, "failed", repr(e))
+        finally:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+
+    def run(self, api_key, workers=1, forever=False, poll=1.0):
+        """Works through the queue on `workers` threads until it's empty."""
+        self.recover()
+        render_workers = int(os.environ.get("RENDER_WORKERS", "1"))
+
+        def work():
+            while True:
+                job = self.claim()
+                if job is None:
+                    if not forever:
+                        return
+                    time.sleep(poll)
+                    continue
+                uids = self.pending_uids(job["id"])
+                print(f"Job {job['id']} ({job['command']}, cost {job['cost']}): {uids}")
+                self.process(job, api_key, render_workers)
+
+        threads = [threading.Thread(target=work) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def status(self):
+        jobs = self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state")
+        total, uploaded, failed = self.db.execute(
+            "SELECT COUNT(*), COUNT(result), COUNT(error) FROM waiters"
+        ).fetchone()
+        return {
+            "jobs": dict(jobs.fetchall()),
+            "waiters": {"total": total, "uploaded": uploaded, "failed": failed},
+        }
+
+
+class Transaction:
+    """BEGIN IMMEDIATE ... COMMIT/ROLLBACK, so check-then-write is atomic."""
+
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute("BEGIN IMMEDIATE")
+        return self.db
+
+    def __exit__(self, exc_type, *exc):
+        self.db.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+def read_payload(payload_path=None):
+    """Raw payload from a file, "-" for stdin, or RENDER_PAYLOAD_JSON."""
+    if payload_path == "-":
+        return json.load(sys.stdin)
+    if payload_path:
+        with open(payload_path, encoding="utf-8") as f:
+            return json.load(f)
+    return json.loads(os.environ["RENDER_PAYLOAD_JSON"])
+
+
+def main():
+    args = sys.argv[1:]
+    scheduler = Scheduler()
+    thread = None
+    if "--thread" in args[:-1]:
+        index = args.index("--thread")
+        thread = args[index + 1]
+        del args[index : index + 2]
+    if args[:1] == ["submit"] and len(args) >= 3:
+        _, command, uid, *payload_path = args
+        if command not in ("render_and_upload", "render_and_upload_reddit_chain"):
+            print(f"Unknown command: {command}")
+            sys.exit(1)
+        job_id = scheduler.submit(
+            command, uid, read_payload(*payload_path), thread=thread
+        )
+        print(f"Queued {uid} as job {job_id}.")
+    elif args[:1] == ["run"]:
+        api_key = os.environ.get("ALLTHEPICS_API_KEY")
+        if not api_key:
+            print("Error: ALLTHEPICS_API_KEY environment variable not set.")
+            sys.exit(1)
+        numbers = [int(arg) for arg in args[1:] if arg.isdigit()]
+        renderer.load_snapshot()
+        scheduler.run(
+            api_key, workers=numbers[0] if numbers else 1, forever="--forever" in args
+        )
+        renderer.text_cache.report()
+        print(json.dumps(scheduler.status()))
+    elif args[:1] == ["status"]:
+        print(json.dumps(scheduler.status(), indent=2))
+    else:
+        print(__doc__.split("\n\n")[-1])
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Antialiased shape masks from signed distance fields.
+
+A shape's signed distance (negative inside) is evaluated with NumPy at the
+center of every pixel it could partly cover, and the pixel's coverage is
+clip(0.5 - distance, 0, 1). That is exact for straight edges and within a
+level or two for curves at these radii, and it comes out at the target
+resolution, so nothing is drawn large and downsampled.
+
+Coordinates follow ImageDraw: pixel (x, y) is centered on (x, y), and a box
+(x0, y0, x1, y1) covers pixels x0..x1 and y0..y1 inclusive.
+"""
+
+import math
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+def coverage(distance):
+    """8-bit coverage of pixels whose centers are `distance` from an edge."""
+    return (np.clip(0.5 - distance, 0.0, 1.0) * 255 + 0.5).astype(np.uint8)
+
+
+def pixel_grid(left, top, right, bottom):
+    """Broadcastable x and y of the pixel centers in [left, right) x [top, bottom)."""
+    y, x = np.ogrid[top:bottom, left:right]
+    return x.astype(np.float32), y.astype(np.float32)
+
+
+def rounded_rect_sdf(x, y, box, radius):
+    """Signed distance to the rounded rectangle `box` with corner `radius`."""
+    x0, y0, x1, y1 = box
+    radius = min(radius, (x1 - x0 + 1) / 2, (y1 - y0 + 1) / 2)
+    # The box's outer edges are half a pixel beyond its first and last centers.
+    half_w = (x1 - x0 + 1) / 2 - radius
+    half_h = (y1 - y0 + 1) / 2 - radius
+    qx = np.abs(x - (x0 + x1) / 2) - half_w
+    qy = np.abs(y - (y0 + y1) / 2) - half_h
+    outside = np.hypot(np.maximum(qx, 0), np.maximum(qy, 0))
+    inside = np.minimum(np.maximum(qx, qy), 0)
+    return outside + inside - radius
+
+
+def polygon_sdf(x, y, points):
+    """Signed distance to the simple polygon with (x, y) vertices `points`."""
+    x, y = np.broadcast_arrays(x, y)
+    nearest = np.full(x.shape, np.inf, dtype=np.float32)
+    inside = np.zeros(x.shape, dtype=bool)
+    for (ax, ay), (bx, by) in zip(points, points[-1:] + points[:-1]):
+        ex, ey = bx - ax, by - ay
+        wx, wy = x - ax, y - ay
+        t = np.clip((wx * ex + wy * ey) / (ex * ex + ey * ey), 0, 1)
+        nearest = np.minimum(nearest, (wx - ex * t) ** 2 + (wy - ey * t) ** 2)
+        # Even-odd rule: count the edges a ray towards +x crosses.
+        above, below, left = y >= ay, y < by, ex * wy > ey * wx
+        inside ^= (above & below & left) | ~(above | below | left)
+    return np.where(inside, -1, 1) * np.sqrt(nearest)
+
+
+def circle_mask(size):
+    """size x size mask of the disc filling the square."""
+    x, y = pixel_grid(0, 0, size, size)
+    center = (size - 1) / 2
+    return Image.fromarray(coverage(np.hypot(x - center, y - center) - size / 2))
+
+
+def bubble_patches(box, radius, tail=()):
+    """
+    Coverage of the rounded rectangle `box` joined with the `tail` polygon
+    wherever it can be partial: a (mask, (left, top)) patch per corner and
+    one around the tail. Everything else inside the box is fully covered,
+    since the straight edges fall on pixel boundaries.
+    """
+    x0, y0, x1, y1 = box
+    radius = min(radius, (x1 - x0 + 1) / 2, (y1 - y0 + 1) / 2)
+    points = [tuple(point) for point in tail]
+    r = math.ceil(radius)
+    # (region, joined with the tail?). Every pixel the tail reaches is in its
+    # own region, which comes last and so wins where it overlaps a corner.
+    regions = [
+        ((x0, y0, x0 + r, y0 + r), False),
+        ((x1 + 1 - r, y0, x1 + 1, y0 + r), False),
+        ((x0, y1 + 1 - r, x0 + r, y1 + 1), False),
+        ((x1 + 1 - r, y1 + 1 - r, x1 + 1, y1 + 1), False),
+    ]
+    if points:
+        xs, ys = [px for px, _ in points], [py for _, py in points]
+        tail_box = (
+            math.floor(min(xs)) - 1,
+            math.floor(min(ys)) - 1,
+            math.ceil(max(xs)) + 2,
+            math.ceil(max(ys)) + 2,
+        )
+        regions.append((tail_box, True))
+
+    patches = []
+    for (left, top, right, bottom), with_tail in regions:
+        x, y = pixel_grid(left, top, right, bottom)
+        distance = rounded_rect_sdf(x, y, box, radius)
+        if with_tail:
+            distance = np.minimum(distance, polygon_sdf(x, y, points))
+        patches.append((Image.fromarray(coverage(distance)), (left, top)))
+    return patches
+
+
+def draw_bubble(layer, box, radius, fill, tail=()):
+    """
+    Draws the antialiased bubble (see bubble_patches) onto the transparent
+    RGBA `layer`, which must have nothing else within two pixels of it.
+    Pixels come out as `fill` with the coverage as alpha, ready for
+    alpha_composite.
+    """
+    x0, y0, x1, y1 = box
+    r = math.ceil(min(radius, (x1 - x0 + 1) / 2, (y1 - y0 + 1) / 2))
+    draw = ImageDraw.Draw(layer)
+    # Both arms of the cross between the corners; gone when the corners meet.
+    for rect in ((x0 + r, y0, x1 - r, y1), (x0, y0 + r, x1, y1 - r)):
+        if rect[0] <= rect[2] and rect[1] <= rect[3]:
+            draw.rectangle(rect, fill=fill)
+    # Patches are copied rather than composited, so where the tail's patch
+    # overlaps a corner's the joined coverage replaces it instead of being
+    # blended over it.
+    for mask, origin in bubble_patches(box, radius, tail):
+        patch = Image.new("RGBA", mask.size, fill)
+        patch.putalpha(mask)
+        layer.paste(patch, origin)
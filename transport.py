@@ -0,0 +1,242 @@
+"""
+Shared HTTP transport for renderer.py and manage_status.py.
+
+Every request goes through one Transport, which keeps a pooled keep-alive
+session per host, applies connect/read timeouts, retries failed requests with
+exponential backoff out of a process-wide retry budget (so a dead host can't
+turn every request into several), and records response times per host.
+
+Settings come from the environment:
+    HTTP_CONNECT_TIMEOUT  seconds to establish a connection (default 5)
+    HTTP_READ_TIMEOUT     seconds to wait for response data (default 30)
+    HTTP_RETRIES          retries per request (default 2)
+    HTTP_RETRY_BUDGET     retries available to the whole process (default 10);
+                          each successful request earns back a tenth of one
+    HTTP_RETRY_BACKOFF    base backoff in seconds, doubled per retry (default 1)
+
+Only depends on requests, so the status workflow can use it as is.
+"""
+
+import collections
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Responses worth another attempt; anything else is returned to the caller.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class RetryBudget:
+    """Token bucket shared by every request: each retry spends one token."""
+
+    def __init__(self, capacity=10, refill=0.1):
+        self.capacity = capacity
+        self.refill = refill
+        self.tokens = float(capacity)
+        self.lock = threading.Lock()
+
+    def withdraw(self) -> bool:
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.capacity, self.tokens + self.refill)
+
+
+class Metrics:
+    """Per-host request counts, failures, retries and response times."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.hosts = collections.defaultdict(
+                lambda: {
+                    "requests": 0,
+                    "errors": 0,
+                    "retries": 0,
+                    "seconds": collections.deque(maxlen=self.window),
+                }
+            )
+
+    def record(self, host, seconds, ok, retry=False):
+        with self.lock:
+            stats = self.hosts[host]
+            stats["requests"] += 1
+            stats["errors"] += not ok
+            stats["retries"] += retry
+            stats["seconds"].append(seconds)
+
+    def summary(self) -> dict:
+        """{host: {requests, errors, retries, p50, p95, p99, max}}, in seconds."""
+        with self.lock:
+            result = {}
+            for host, stats in self.hosts.items():
+                times = sorted(stats["seconds"])
+                pick = lambda q: times[min(len(times) - 1, int(q * len(times)))]
+                result[host] = {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "retries": stats["retries"],
+                    "p50": pick(0.5) if times else None,
+                    "p95": pick(0.95) if times else None,
+                    "p99": pick(0.99) if times else None,
+                    "max": times[-1] if times else None,
+                }
+            return result
+
+    def report(self):
+        for host, stats in sorted(self.summary().items()):
+            print(
+                f"HTTP {host}: {stats['requests']} requests, {stats['errors']} failed, "
+                f"{stats['retries']} retries, p50 {stats['p50']:.3f}s, "
+                f"p95 {stats['p95']:.3f}s, max {stats['max']:.3f}s"
+            )
+
+
+class Transport:
+    def __init__(
+        self,
+        connect_timeout=5.0,
+        read_timeout=30.0,
+        retries=2,
+        retry_budget=10,
+        backoff=1.0,
+        pool_size=8,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.budget = RetryBudget(retry_budget)
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.metrics = Metrics()
+        self.session_factories = {}
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        env = os.environ.get
+        return cls(
+            connect_timeout=float(env("HTTP_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(env("HTTP_READ_TIMEOUT", "30")),
+            retries=int(env("HTTP_RETRIES", "2")),
+            retry_budget=int(env("HTTP_RETRY_BUDGET", "10")),
+            backoff=float(env("HTTP_RETRY_BACKOFF", "1")),
+        )
+
+    @staticmethod
+    def host(url):
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def register(self, url, session_factory):
+        """Builds `url`'s host session with `session_factory`, e.g. cloudscraper."""
+        with self.lock:
+            self.session_factories[self.host(url)] = session_factory
+            self.sessions.pop(self.host(url), None)
+
+    def session(self, url) -> requests.Session:
+        """The pooled keep-alive session for `url`'s host."""
+        host = self.host(url)
+        with self.lock:
+            if host not in self.sessions:
+                factory = self.session_factories.get(host)
+                if factory is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=1, pool_maxsize=self.pool_size
+                    )
+                    session.mount(host, adapter)
+                else:
+                    # Keep the factory's own adapters (cloudscraper's carries
+                    # its cipher suite) and only resize their pool.
+                    session = factory()
+                    self._resize_pool(session.get_adapter(url))
+                self.sessions[host] = session
+            return self.sessions[host]
+
+    def _resize_pool(self, adapter):
+        if not isinstance(adapter, HTTPAdapter):
+            return
+        adapter._pool_maxsize = self.pool_size
+        adapter.init_poolmanager(
+            adapter._pool_connections, self.pool_size, block=adapter._pool_block
+        )
+
+    def reset(self):
+        """Drops every session; a forked child mustn't reuse the parent's sockets."""
+        # Any lock may have been held by a thread that doesn't exist in the
+        # child, so they're replaced rather than acquired.
+        self.lock = threading.Lock()
+        self.metrics.lock = threading.Lock()
+        self.budget.lock = threading.Lock()
+        self.sessions = {}
+
+    def request(self, method, url, *, retries=None, **kwargs) -> requests.Response:
+        """
+        Sends one request through the host's session. Connection errors and
+        RETRY_STATUSES responses are retried up to `retries` times while the
+        retry budget lasts; after that the last error is raised, or the last
+        response returned.
+        """
+        retries = self.retries if retries is None else retries
+        kwargs.setdefault("timeout", self.timeout)
+        session = self.session(url)
+        host = self.host(url)
+
+        for attempt in range(retries + 1):
+            if hasattr(kwargs.get("data"), "seek"):
+                kwargs["data"].seek(0)  # Resend a streamed body from the start.
+            started = time.perf_counter()
+            try:
+                response = session.request(method, url, **kwargs)
+            except requests.RequestException:
+                elapsed = time.perf_counter() - started
+                self.metrics.record(host, elapsed, False, retry=attempt > 0)
+                if attempt == retries or not self.budget.withdraw():
+                    raise
+            else:
+                elapsed = time.perf_counter() - started
+                ok = response.status_code not in RETRY_STATUSES
+                self.metrics.record(host, elapsed, ok, retry=attempt > 0)
+                if ok:
+                    self.budget.deposit()
+                    return response
+                if attempt == retries or not self.budget.withdraw():
+                    return response
+                response.close()
+            # Full jitter keeps concurrent jobs from retrying in lockstep.
+            time.sleep(random.uniform(0, self.backoff * 2**attempt))
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def preconnect(self, url):
+        """
+        Opens the pooled connection to `url`'s host ahead of time, so the TLS
+        handshake (and any Cloudflare challenge) is done before it's needed.
+        """
+        try:
+            self.request("HEAD", url, retries=0)
+        except requests.RequestException as e:
+            print(f"Warning: Could not pre-connect to {self.host(url)}: {e}")
+
+
+http = Transport.from_env()
+os.register_at_fork(after_in_child=http.reset)